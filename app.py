@@ -1,25 +1,43 @@
-from flask import Flask, render_template, request, redirect, flash, url_for
+from flask import Flask, render_template, request, redirect, flash, url_for, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import os
+import json
+import time
 import secrets
+from datetime import datetime
 
-from utils import parse_excel
+from utils import check_columns, SHEET_EXTENSIONS
 from content import generate_content
-from main import dispatch_message
+from jobs import enqueue_job, get_job, resume_job, retry_dead_letters
+from worker import start_inline_worker
+from uploads import SpoolingRequest, spool_sheet, is_parsed
+from contact_store import ContactStore
+import metrics
 
 from flask import Flask, request, jsonify
 from content import generate_content 
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
+# Uploaded files stream to disk as they arrive instead of into memory
+app.request_class = SpoolingRequest
 
-# Optional: upload settings
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB
-app.config['UPLOAD_EXTENSIONS'] = ['.xlsx', '.xls']
+# Upload settings: sheet plus attachments, in MB
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', '100'))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+app.config['UPLOAD_EXTENSIONS'] = SHEET_EXTENSIONS
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    with ContactStore() as store:
+        contact_lists = store.lists()
+    return render_template('index.html', contact_lists=contact_lists)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    flash(f"❌ Upload is larger than {MAX_UPLOAD_MB} MB.", 'error')
+    return redirect(url_for('index'))
+
 
 @app.route('/generate-message', methods=['POST'])
 def generate_message():
@@ -35,24 +53,87 @@ def generate_message():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/generate-message/stream', methods=['POST'])
+def generate_message_stream():
+    """
+    Same input as /generate-message, streamed back as Server-Sent Events:
+    "data: {"delta": ...}" per chunk, then "event: done" (or "event: error").
+    """
+    data = request.json
+    mode = data.get('mode', 'email')
+    user_message = data.get('user_message', '')
+    subject = data.get('subject', '')
+
+    def events():
+        for delta in generate_content(mode, user_message, subject=subject, stream=True):
+            if delta.startswith('[ERROR]'):
+                yield f"event: error\ndata: {json.dumps({'error': delta})}\n\n"
+                return
+            yield f"data: {json.dumps({'delta': delta})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/trigger', methods=['POST'])
 def trigger_action():
-    # Step 1: Excel file
+    # Step 1: Excel file, or a saved contact list
     excel_file = request.files.get('excel_file')
-    if not excel_file:
-        flash("❌ Please upload an Excel file.", 'error')
-        return redirect(url_for('index'))
+    contact_list = request.form.get('contact_list', '').strip() or None
+    contact_filter = None
+    sheet = None
+    save_list_as = None
+    list_base = None
+    delta_baseline = None
 
-    filename = secure_filename(excel_file.filename)
-    if not filename.lower().endswith(tuple(app.config['UPLOAD_EXTENSIONS'])):
-        flash("❌ Invalid file format. Only .xlsx or .xls allowed.", 'error')
+    if contact_list:
+        with ContactStore() as store:
+            if store.get_list(contact_list) is None:
+                flash(f"❌ No saved contact list named '{contact_list}'.", 'error')
+                return redirect(url_for('index'))
+        contact_filter = {
+            key: request.form.get(f'filter_{key}', '').strip()
+            for key in ('name', 'email_domain', 'phone_prefix')
+            if request.form.get(f'filter_{key}', '').strip()
+        }
+    elif not excel_file:
+        flash("❌ Please upload an Excel file or choose a saved contact list.", 'error')
         return redirect(url_for('index'))
+    else:
+        filename = secure_filename(excel_file.filename)
+        if not filename.lower().endswith(tuple(app.config['UPLOAD_EXTENSIONS'])):
+            flash("❌ Invalid file format. Only .xlsx, .xls or .csv allowed.", 'error')
+            return redirect(url_for('index'))
 
-    # Step 2: Parse
-    contacts, msg = parse_excel(excel_file)
-    if not contacts:
-        flash(msg, 'error')
-        return redirect(url_for('index'))
+        # Step 2: Store the sheet by content hash and check its header; the worker parses
+        # the rows while it sends. A sheet parsed before needs neither.
+        sheet = spool_sheet(excel_file)
+        if not is_parsed(sheet.digest):
+            ok, msg = check_columns(sheet.path, filename=filename)
+            if not ok:
+                flash(msg, 'error')
+                return redirect(url_for('index'))
+
+        # Step 2.1: Optionally save the sheet as a list; in delta mode only rows added or
+        # changed since the list was last saved are sent
+        save_list_as = request.form.get('save_list_as', '').strip() or None
+        delta = request.form.get('delta') == 'yes'
+        if delta and not save_list_as:
+            flash("❌ Name the saved list to compare with to send only new or changed contacts.", 'error')
+            return redirect(url_for('index'))
+        if save_list_as:
+            # The version this upload replaces; the comparison copies its rows now, so a
+            # resumed campaign still compares against them once the version is gone
+            with ContactStore() as store:
+                previous = store.get_list(save_list_as)
+                if previous is not None:
+                    list_base = previous['id']
+                    if delta:
+                        delta_baseline = store.snapshot(previous['id'])
 
     # Step 3: Get preferences
     mode = request.form.get('mode')
@@ -67,63 +148,136 @@ def trigger_action():
         flash("❌ Please select a communication mode.", 'error')
         return redirect(url_for('index'))
 
-    successes = []
-    failures = []
-
-    # Step 4: Loop through all contacts
-
-    for contact in contacts:
-        if use_custom == 'yes' and user_message:
-            content = user_message
-        elif use_custom == 'no':
-            content = generate_content(mode, user_message, recipient_name=contact.get('name', 'User'))
-        else:
-            failures.append((contact, "❌ Please enter a message or choose to auto-generate it."))
-            continue
-
-        # Step 5: Pick email or phone based on mode
-        if mode in ['sms', 'whatsapp', 'call']:
-            contact_value = contact.get('phone')
-        else:
-            contact_value = contact.get('email')
-
-        if not contact_value:
-            failures.append((contact, f"❌ Contact info missing for mode '{mode}'."))
-            continue
-
-        # Step 6: Send message
-        if mode == 'email':
-            # Pass subject and attachments to dispatch_message
-            success, dispatch_msg = dispatch_message(
-                mode,
-                content,
-                contact_value,
-                name=contact.get('name', 'User'),
-                subject=email_subject,
-                attachments=attachments
-            )
-        else:
-            success, dispatch_msg = dispatch_message(mode, content, contact_value)
-
-        if success:
-            successes.append((contact, dispatch_msg))
-        else:
-            failures.append((contact, dispatch_msg))
-
-    # Step 7: Summary
-    if successes:
-        flash(f"✅ Sent to {len(successes)} contact(s).", 'success')
-    if failures:
-        flash(f"⚠️ Failed to send to {len(failures)} contact(s).", 'error')
+    # Step 3.2: Optional extra channels, run alongside the main one, and a channel to
+    # fall back to for contacts the main one fails on
+    modes = list(dict.fromkeys([mode] + request.form.getlist('extra_modes')))
+    fallback_mode = request.form.get('fallback_mode', '').strip()
+    fallbacks = None
+    if fallback_mode:
+        if fallback_mode in modes:
+            flash("❌ The fallback channel must not be one the campaign already sends on.", 'error')
+            return redirect(url_for('index'))
+        fallbacks = {mode: fallback_mode}
+
+    # Step 3.3: Optional start time (server local time) and window to spread the sends over
+    run_at = None
+    spread_seconds = None
+    try:
+        if request.form.get('send_at', '').strip():
+            run_at = datetime.fromisoformat(request.form['send_at'].strip()).timestamp()
+        if request.form.get('spread_hours', '').strip():
+            spread_seconds = float(request.form['spread_hours']) * 3600
+    except ValueError:
+        flash("❌ Invalid start time or delivery window.", 'error')
+        return redirect(url_for('index'))
+    if spread_seconds is not None and spread_seconds <= 0:
+        spread_seconds = None
+
+    # Step 4: Queue the campaign; worker processes do the sending
+    job_id = enqueue_job(
+        mode,
+        use_custom,
+        user_message,
+        email_subject=email_subject,
+        attachments=attachments,
+        sheet=sheet,
+        contact_list=contact_list,
+        contact_filter=contact_filter,
+        save_list_as=save_list_as,
+        list_base=list_base,
+        delta_baseline=delta_baseline,
+        modes=modes if len(modes) > 1 else None,
+        fallbacks=fallbacks,
+        run_at=run_at,
+        spread_seconds=spread_seconds
+    )
+
+    if run_at is not None and run_at > time.time():
+        flash(f"🕒 Campaign scheduled for {datetime.fromtimestamp(run_at):%Y-%m-%d %H:%M}.", 'success')
+    else:
+        flash("📨 Campaign queued.", 'success')
+    return redirect(url_for('job_status', job_id=job_id))
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        flash("❌ Unknown campaign.", 'error')
+        return redirect(url_for('index'))
+
+    # Queued for later: a scheduled start, or a paced campaign waiting for its next release
+    scheduled_for = None
+    if job['status'] == 'queued' and job['run_at'] and job['run_at'] > time.time():
+        scheduled_for = f"{datetime.fromtimestamp(job['run_at']):%Y-%m-%d %H:%M}"
 
     return render_template(
-        'summary.html',
-        successes=successes,
-        failures=failures,
-        mode=mode
+        'job.html',
+        job=job,
+        successes=job['successes'],
+        failures=job['failures'],
+        mode=job['mode'],
+        scheduled_for=scheduled_for
     )
 
 
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job_route(job_id):
+    if resume_job(job_id):
+        flash("🔁 Campaign requeued; recipients already reached will be skipped.", 'success')
+    else:
+        flash("❌ Only finished or failed campaigns still within their retention period can be resumed.", 'error')
+    return redirect(url_for('job_status', job_id=job_id))
+
+
+@app.route('/jobs/<job_id>/dead-letters/retry', methods=['POST'])
+def retry_dead_letters_route(job_id):
+    new_job_ids = retry_dead_letters(job_id)
+    if not new_job_ids:
+        flash("❌ This campaign has no dead letters to retry, or is past its retention period.", 'error')
+        return redirect(url_for('job_status', job_id=job_id))
+
+    # One campaign per channel the dead letters failed on
+    flash(f"🔁 Dead letters queued as {len(new_job_ids)} new campaign(s).", 'success')
+    return redirect(url_for('job_status', job_id=new_job_ids[0]))
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status_json(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    job['successes'] = [{'contact': contact, 'msg': msg} for contact, msg in job['successes']]
+    job['failures'] = [{'contact': contact, 'msg': msg} for contact, msg in job['failures']]
+    job['dead_letters'] = [{'contact': contact, 'msg': msg} for contact, msg in job['dead_letters']]
+    return jsonify(job)
+
+
+@app.route('/metrics')
+def metrics_route():
+    # Prometheus scrape endpoint: every web and worker process writing to METRICS_DIR
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/lists')
+def contact_lists_json():
+    with ContactStore() as store:
+        return jsonify(store.lists())
+
+
+@app.route('/api/contacts')
+def contact_lookup_json():
+    # Indexed lookup by phone and/or email across saved lists
+    phone = request.args.get('phone')
+    email = request.args.get('email')
+    if not phone and not email:
+        return jsonify({'error': 'Pass phone or email'}), 400
+
+    with ContactStore() as store:
+        matches = store.find(phone=phone, email=email)
+    return jsonify([dict(contact.to_dict(), list=list_name, id=contact.id) for list_name, contact in matches])
+
 
 @app.route('/success')
 def success():
@@ -133,4 +287,7 @@ def success():
 if __name__ == '__main__':
     # app.run(debug=True, port=5000)
     port = int(os.environ.get("PORT", 5000))
+    # Local runs process the queue in-process; production runs `python worker.py`
+    if os.environ.get("INLINE_WORKER", "true").lower() == "true":
+        start_inline_worker()
     app.run(host="0.0.0.0", port=port)
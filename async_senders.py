@@ -0,0 +1,346 @@
+"""
+asyncio implementations of the channel senders, for keeping thousands of sends in
+flight on one event loop instead of one OS thread per send.
+
+The blocking senders in main.py are thin wrappers that run these on the shared loop
+(event_loop.py), and the channels and dispatcher await them directly. Messages,
+validation, rate limits and failure formats live in main.py, so results are the same
+(success, message) tuples either way.
+
+    results = dispatch_many([
+        {'mode': 'sms', 'content': 'Hi', 'contact': '+919876543210'},
+        {'mode': 'email', 'content': 'Hi', 'contact': 'a@example.com', 'name': 'A', 'subject': 'Hello'},
+    ])
+"""
+import os
+import json
+import atexit
+import asyncio
+import logging
+import weakref
+import aiohttp
+import aiosmtplib
+from dotenv import load_dotenv
+from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+
+import transport
+import metrics
+import event_loop
+from smtp_pool import AsyncSMTPPool
+from main import (
+    EMAIL_ADDRESS, EMAIL_PASSWORD, FAST2SMS_URL, FAST2SMS_CHUNK_SIZE, TWILIO_API_URL, TWILIO_WHATSAPP_FROM,
+    THROTTLE_STATUSES, SMTP_THROTTLE_CODES,
+    is_valid_email, is_valid_phone, _limiter, _record, _fast2sms_payload, _fast2sms_headers, _build_email,
+    _exotel_request,
+)
+
+load_dotenv()
+
+# Sends awaiting a provider at once in run_batch
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '1000'))
+# Open HTTP connections per event loop (all providers together)
+ASYNC_HTTP_POOL_SIZE = int(os.getenv('ASYNC_HTTP_POOL_SIZE', '100'))
+
+# Per event loop: aiohttp session and Twilio client (both are bound to the loop that made them)
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+class _LoopClients:
+    def __init__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=ASYNC_HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=transport.HTTP_CONNECT_TIMEOUT, sock_read=transport.HTTP_READ_TIMEOUT
+            )
+        )
+        self.twilio = None
+
+    def get_twilio_client(self):
+        if self.twilio is None:
+            account_sid = os.getenv("TWILIO_SID")
+            auth_token = os.getenv("TWILIO_TOKEN")
+            if not account_sid or not auth_token:
+                return None
+            http_client = AsyncTwilioHttpClient(timeout=transport.HTTP_READ_TIMEOUT)
+            self.twilio = Client(account_sid, auth_token, http_client=http_client)
+            if TWILIO_API_URL:
+                self.twilio.api.base_url = TWILIO_API_URL
+        return self.twilio
+
+    async def close(self):
+        await self.session.close()
+        if self.twilio is not None:
+            await self.twilio.http_client.close()
+
+
+def _clients():
+    loop = asyncio.get_running_loop()
+    clients = _loop_clients.get(loop)
+    if clients is None:
+        clients = _loop_clients[loop] = _LoopClients()
+    return clients
+
+
+async def close_clients():
+    """
+    Close the running loop's HTTP session and Twilio client.
+    """
+    clients = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients.close()
+
+
+@atexit.register
+def _close_all_clients():
+    # The shared loop runs on a daemon thread: close its sessions while it is still running
+    for loop, clients in list(_loop_clients.items()):
+        if loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(clients.close(), loop).result(5)
+            except Exception:
+                logging.warning("Could not close HTTP sessions at exit", exc_info=True)
+
+
+async def _acquire(mode):
+    limiter = _limiter(mode)
+    wait = limiter.reserve()
+    if wait > 0:
+        await asyncio.sleep(wait)
+    return limiter
+
+
+async def _post(mode, url, data, headers=None):
+    """
+    POST through the loop's session, paced and throttle-tracked per channel.
+    Returns a tuple: (status, body text)
+    """
+    limiter = await _acquire(mode)
+    with metrics.timer('provider', mode):
+        async with _clients().session.post(url, data=data, headers=headers) as response:
+            text = await response.text()
+    _record(limiter, response.status in THROTTLE_STATUSES)
+    return response.status, text
+
+
+async def send_sms_async(content, phone_number):
+    if not is_valid_phone(phone_number):
+        return False, f"Invalid phone number: {phone_number}"
+
+    headers = {key: value for key, value in _fast2sms_headers().items() if value is not None}
+    try:
+        status, text = await _post('sms', FAST2SMS_URL, _fast2sms_payload(content, [phone_number]), headers)
+        if status == 200:
+            logging.info(f"SMS sent to {phone_number}")
+            return True, "SMS sent successfully"
+        logging.error(f"Fast2SMS failed ({status}): {text}")
+        return False, f"SMS failed (HTTP {status}): {text}"
+    except Exception as e:
+        logging.error("Exception in send_sms_async", exc_info=True)
+        return False, f"{type(e).__name__}: {e}"
+
+
+async def _send_sms_chunk(content, phone_numbers, headers):
+    try:
+        status, text = await _post('sms', FAST2SMS_URL, _fast2sms_payload(content, phone_numbers), headers)
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+
+        # Fast2SMS accepts or rejects the whole request, so the outcome applies to every number in it
+        if status == 200 and data.get("return", True):
+            logging.info(f"Bulk SMS sent to {len(phone_numbers)} number(s), request_id: {data.get('request_id')}")
+            return True, f"SMS sent successfully (request {data.get('request_id')})"
+        logging.error(f"Fast2SMS bulk request failed ({status}): {text}")
+        return False, f"SMS failed (HTTP {status}): {text}"
+    except Exception as e:
+        logging.error("Exception in send_sms_bulk_async", exc_info=True)
+        return False, f"{type(e).__name__}: {e}"
+
+
+async def send_sms_bulk_async(content, phone_numbers, chunk_size=None):
+    """
+    Send the same SMS to many numbers, one Fast2SMS request per chunk, chunks concurrently.
+    Returns a list of (success, message) tuples in the same order as phone_numbers.
+    """
+    chunk_size = chunk_size or FAST2SMS_CHUNK_SIZE
+    results = [None] * len(phone_numbers)
+
+    # Invalid numbers fail individually and never reach the provider
+    valid = []
+    for idx, phone_number in enumerate(phone_numbers):
+        if is_valid_phone(phone_number):
+            valid.append(idx)
+        else:
+            results[idx] = (False, f"Invalid phone number: {phone_number}")
+
+    headers = {key: value for key, value in _fast2sms_headers().items() if value is not None}
+    chunks = [valid[start:start + chunk_size] for start in range(0, len(valid), chunk_size)]
+    outcomes = await asyncio.gather(*(
+        _send_sms_chunk(content, [phone_numbers[idx] for idx in chunk], headers) for chunk in chunks
+    ))
+    for chunk, result in zip(chunks, outcomes):
+        for idx in chunk:
+            results[idx] = result
+    return results
+
+
+async def send_email_async(name, recipient_email, message_body, subject=None, attachments=None, smtp_pool=None):
+    """
+    Pass an AsyncSMTPPool as smtp_pool to reuse sessions across a batch; without one the
+    email goes over a single-session pool that is closed straight away.
+    """
+    if not is_valid_email(recipient_email):
+        return False, f"Invalid email address: {recipient_email}"
+
+    if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
+        logging.error("Email credentials not set in environment variables")
+        return False, "Email credentials not configured"
+
+    msg = _build_email(recipient_email, message_body, subject=subject, attachments=attachments)
+
+    limiter = None
+    try:
+        limiter = await _acquire('email')
+        with metrics.timer('provider', 'email'):
+            if smtp_pool is not None:
+                await smtp_pool.send_message(msg)
+            else:
+                async with AsyncSMTPPool(size=1) as pool:
+                    await pool.send_message(msg)
+        logging.info(f"Email sent to {recipient_email}")
+        limiter.succeeded()
+        return True, f"Email sent to {name} successfully"
+    except aiosmtplib.SMTPResponseException as e:
+        logging.error("SMTP error in send_email_async", exc_info=True)
+        if limiter is not None:
+            _record(limiter, e.code in SMTP_THROTTLE_CODES)
+        return False, f"Email failed (SMTP {e.code}): {e.message}"
+    except Exception as e:
+        logging.error("Exception in send_email_async", exc_info=True)
+        return False, f"{type(e).__name__}: {e}"
+
+
+async def send_whatsapp_async(content, phone_number):
+    if not is_valid_phone(phone_number):
+        return False, f"Invalid WhatsApp number: {phone_number}"
+
+    client = _clients().get_twilio_client()
+    if client is None:
+        logging.error("Twilio credentials not set in environment variables")
+        return False, "Twilio credentials not configured"
+
+    limiter = None
+    try:
+        limiter = await _acquire('whatsapp')
+        with metrics.timer('provider', 'whatsapp'):
+            message = await client.messages.create_async(
+                body=content,
+                from_=TWILIO_WHATSAPP_FROM,
+                to=f'whatsapp:{phone_number}'
+            )
+        logging.info(f"WhatsApp message sent to {phone_number}, SID: {message.sid}")
+        limiter.succeeded()
+        return True, f"WhatsApp sent: {message.sid}"
+    except TwilioRestException as e:
+        logging.error("Twilio error in send_whatsapp_async", exc_info=True)
+        if limiter is not None:
+            _record(limiter, e.status in THROTTLE_STATUSES)
+        return False, f"WhatsApp failed (HTTP {e.status}): {e.msg}"
+    except Exception as e:
+        logging.error("Exception in send_whatsapp_async", exc_info=True)
+        return False, f"{type(e).__name__}: {e}"
+
+
+async def handle_call_async(content, phone_number):
+    if not is_valid_phone(phone_number):
+        return False, f"Invalid phone number for call: {phone_number}"
+
+    request = _exotel_request(phone_number)
+    if request is None:
+        logging.error("Exotel credentials not set in environment variables")
+        return False, "Exotel credentials not configured"
+    url, payload = request
+
+    try:
+        status, text = await _post('call', url, payload)
+        if status == 200:
+            logging.info(f"Call initiated to {phone_number}")
+            return True, "Call initiated successfully"
+        logging.error(f"Exotel call failed ({status}): {text}")
+        return False, f"Call failed (HTTP {status}): {text}"
+    except Exception as e:
+        logging.error("Exception in handle_call_async", exc_info=True)
+        return False, f"{type(e).__name__}: {e}"
+
+
+async def dispatch_message_async(mode, content, contact, name=None, subject=None, attachments=None, smtp_pool=None):
+    """
+    Async dispatch_message through the channel registry: same arguments and results.
+    Pass an AsyncSMTPPool as smtp_pool to reuse sessions across a whole batch.
+    """
+    # channels.py is built on the senders in this module, so it is imported on first use
+    from channels import get_channel
+
+    channel = get_channel(mode)
+    if channel is None:
+        return False, f"Unsupported communication mode: {mode}"
+
+    error = channel.validate(contact)
+    if error:
+        return False, error
+
+    if subject is None and attachments is None and smtp_pool is None:
+        return await channel.send_async(content, contact, name=name)
+
+    prepared = channel.prepare(subject=subject, attachments=attachments, concurrency=1, smtp_pool=smtp_pool)
+    try:
+        return await prepared.send_async(content, contact, name=name)
+    finally:
+        await prepared.close_async()
+
+
+async def run_batch(messages, max_in_flight=None, smtp_pool=None):
+    """
+    Send many messages concurrently on the running loop, at most max_in_flight at a time.
+    Each message is a dict of dispatch_message_async arguments (mode, content, contact,
+    and optionally name, subject, attachments); pre-encode shared attachments with
+    prepare_attachments so they are not encoded per message.
+    Returns a list of (success, message) tuples in input order.
+    """
+    messages = list(messages)
+    results = [None] * len(messages)
+    max_in_flight = max_in_flight or ASYNC_MAX_IN_FLIGHT
+
+    own_pool = smtp_pool is None and any(message['mode'] == 'email' for message in messages)
+    if own_pool:
+        smtp_pool = AsyncSMTPPool()
+
+    # A fixed set of workers pulls from one iterator: no task per message, however large the batch
+    pending = iter(enumerate(messages))
+
+    async def worker():
+        for idx, message in pending:
+            try:
+                results[idx] = await dispatch_message_async(smtp_pool=smtp_pool, **message)
+            except Exception as e:
+                logging.error("Exception in run_batch", exc_info=True)
+                results[idx] = (False, f"{type(e).__name__}: {e}")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(max_in_flight, len(messages)))))
+    finally:
+        if own_pool:
+            await smtp_pool.close()
+    return results
+
+
+def dispatch_many(messages, max_in_flight=None):
+    """
+    Blocking wrapper around run_batch for sync callers (runs on the shared event loop).
+    """
+    return event_loop.run(run_batch(messages, max_in_flight=max_in_flight))
@@ -0,0 +1,106 @@
+import io
+import uuid
+import base64
+import mimetypes
+from email.generator import BytesGenerator
+from email.message import MIMEPart
+from email.policy import default as default_policy
+
+# Raw bytes per read: a multiple of 57 so every chunk encodes to whole 76-character base64 lines
+_CHUNK_SIZE = 57 * 1024
+
+
+class SharedPart(MIMEPart):
+    """
+    An attachment whose base64 body is already in SMTP wire form (CRLF line endings),
+    so flatten_message can copy it into each message instead of re-wrapping every line.
+    """
+
+
+class _SharedPartGenerator(BytesGenerator):
+    def _handle_text(self, msg):
+        if isinstance(msg, SharedPart) and self._NL == '\r\n':
+            self.write(msg.get_payload())
+            return
+        super()._handle_text(msg)
+
+    # Generator binds _writeBody to its own _handle_text for non-text parts
+    _writeBody = _handle_text
+
+
+def flatten_message(msg):
+    """
+    Serialize a message for SMTP (CRLF line endings), copying SharedPart bodies verbatim.
+    """
+    # The generator otherwise regex-scans the whole body for a boundary collision;
+    # '=_' never occurs in base64 output
+    if msg.is_multipart() and not msg.get_boundary():
+        msg.set_boundary(f"=_{uuid.uuid4().hex}")
+
+    buffer = io.BytesIO()
+    _SharedPartGenerator(buffer, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
+    return buffer.getvalue()
+
+
+def _encode_bytes(data):
+    return base64.encodebytes(data).decode('ascii').replace('\n', '\r\n')
+
+
+def _encode(stream):
+    """
+    Base64-encode a binary stream in chunks, so large (disk-spooled) uploads
+    are never held in memory raw and encoded at the same time.
+    """
+    lines = []
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines.append(_encode_bytes(chunk))
+    return ''.join(lines)
+
+
+def _build_part(filename, encoded):
+    # Guess MIME type
+    mime_type, _ = mimetypes.guess_type(filename)
+    if not mime_type:
+        mime_type = 'application/octet-stream'
+
+    part = SharedPart(policy=default_policy)
+    part['Content-Type'] = mime_type
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    part.set_payload(encoded)
+    return part
+
+
+def prepare_attachment(filename, stream):
+    """
+    Build a ready-to-send MIME part from a binary stream.
+    The part is shared by every message in a campaign: treat it as read-only.
+    """
+    return _build_part(filename, _encode(stream))
+
+
+def prepare_attachments(attachments):
+    """
+    Encode every attachment once, up front.
+    Accepts uploaded FileStorage objects, (filename, bytes) pairs, (filename, path) pairs
+    for files already on disk, or parts prepared earlier (passed through).
+    Returns a list of MIME parts for send_email.
+    """
+    parts = []
+    for attachment in attachments or []:
+        if isinstance(attachment, MIMEPart):
+            parts.append(attachment)
+        elif isinstance(attachment, tuple):
+            filename, data = attachment
+            if isinstance(data, bytes):
+                parts.append(_build_part(filename, _encode_bytes(data)))
+            else:
+                with open(data, 'rb') as f:
+                    parts.append(prepare_attachment(filename, f))
+        elif attachment and attachment.filename:
+            parts.append(prepare_attachment(attachment.filename, attachment.stream))
+            attachment.seek(0)  # Reset pointer if needed elsewhere
+    return parts
@@ -0,0 +1,144 @@
+"""
+Benchmark contact ingestion on synthetic sheets: the original iterrows parser vs
+utils.parse_excel (vectorized) vs utils.iter_contacts (streaming, time to first chunk).
+
+Each run happens in a fresh process so peak RSS is measured per implementation.
+
+    python benchmarks/bench_parse_excel.py --sizes 10000 100000 500000 --formats xlsx csv
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+
+import pandas as pd
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils  # noqa: E402
+
+
+def legacy_parse_excel(file_storage):
+    """
+    The pre-vectorization parser (pd.read_excel + df.iterrows), kept as the baseline.
+    """
+    try:
+        df = pd.read_excel(file_storage)
+    except Exception as e:
+        return None, f"❌ Error reading Excel file: {str(e)}"
+
+    missing_columns = [col for col in utils.REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        return None, f"❌ Missing required columns: {', '.join(missing_columns)}"
+
+    contacts = []
+    for idx, row in df.iterrows():
+        name = str(row.get('Name', '')).strip()
+        phone = str(row.get('Phone', '')).strip()
+        email = str(row.get('Email', '')).strip()
+
+        if not name or not phone or not email:
+            print(f"⚠️ Row {idx + 2} skipped — missing fields: Name='{name}', Phone='{phone}', Email='{email}'")
+            continue
+
+        contacts.append({'name': name, 'phone': phone, 'email': email})
+
+    if not contacts:
+        return None, "❌ No valid contacts found in the Excel file."
+    return contacts, f"✅ Successfully parsed {len(contacts)} contact(s)."
+
+
+def make_rows(count, seed=7):
+    rng = random.Random(seed)
+    for i in range(count):
+        phone = 9000000000 + rng.randrange(999999999)
+        # ~1% incomplete rows and a mix of numeric and text phone cells, like real uploads
+        name = '' if i % 100 == 99 else f"Student {i}"
+        yield name, phone if i % 2 else f"+91{phone}", f"student{i}@example.edu"
+
+
+def write_sheet(path, fmt, count):
+    if fmt == 'csv':
+        pd.DataFrame(make_rows(count), columns=utils.REQUIRED_COLUMNS).to_csv(path, index=False)
+        return
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(utils.REQUIRED_COLUMNS)
+    for row in make_rows(count):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def _run(impl, path, queue):
+    start = time.perf_counter()
+    first_chunk = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        if impl == 'legacy':
+            contacts, _ = legacy_parse_excel(path)
+            rows = len(contacts or [])
+        elif impl == 'parse_excel':
+            contacts, _ = utils.parse_excel(path)
+            rows = len(contacts or [])
+        else:
+            rows = 0
+            for chunk in utils.iter_contacts(path):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                rows += len(chunk)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux
+    queue.put({
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'first_chunk_seconds': round(first_chunk, 3) if first_chunk is not None else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+
+
+def measure(impl, path):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run, args=(impl, path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    result['rows_per_second'] = round(result['rows'] / result['seconds']) if result['seconds'] else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--formats', nargs='+', default=['xlsx', 'csv'], choices=['xlsx', 'csv'])
+    parser.add_argument('--skip-legacy', action='store_true', help="skip the slow iterrows baseline")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in args.formats:
+            for size in args.sizes:
+                path = os.path.join(tmp, f"contacts_{size}.{fmt}")
+                write_sheet(path, fmt, size)
+
+                impls = ['parse_excel', 'iter_contacts']
+                # The original parser only ever read Excel
+                if fmt == 'xlsx' and not args.skip_legacy:
+                    impls.insert(0, 'legacy')
+
+                for impl in impls:
+                    result = measure(impl, path)
+                    result.update({'format': fmt, 'size': size, 'impl': impl})
+                    results.append(result)
+                    print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
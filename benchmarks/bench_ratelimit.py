@@ -0,0 +1,158 @@
+"""
+Rate-limit harness: drives main.send_sms against a simulated Fast2SMS that enforces
+its own requests/second limit (answering 429 above it) and checks that
+
+- with a provider looser than the channel limit, sustained throughput sits at RATE_LIMIT_SMS;
+- with a provider tighter than the channel limit, the adaptive bucket backs off to
+  roughly the provider's rate instead of failing most sends;
+- several worker processes sharing the SQLite bucket stay under one combined limit.
+
+Exits non-zero if any check fails.
+
+    python benchmarks/bench_ratelimit.py --seconds 6 --rate 20
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main as providers  # noqa: E402
+import ratelimit  # noqa: E402
+
+# Sends started in the first second ride on the bucket's initial burst
+WARMUP = 1.0
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        accepted = self.server.limit.try_acquire()
+        self.server.log(accepted)
+        body = b'{"return": true, "request_id": "sim"}' if accepted else b'{"return": false, "message": "Too many requests"}'
+        self.send_response(200 if accepted else 429)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SimulatedProvider(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, rate):
+        super().__init__(('127.0.0.1', 0), ProviderHandler)
+        # Provider-side limit, one second of burst like most APIs allow
+        self.limit = ratelimit.TokenBucket(rate)
+        self.events = []
+        self._lock = threading.Lock()
+
+    def log(self, accepted):
+        with self._lock:
+            self.events.append((time.monotonic(), accepted))
+
+    def reset(self, rate):
+        self.limit = ratelimit.TokenBucket(rate)
+        with self._lock:
+            self.events = []
+
+
+def _send_for(url, rate, db_path, seconds, threads):
+    # Runs in each worker process (or the main one): real send path, simulated endpoint
+    providers.FAST2SMS_URL = url
+    providers.RATE_LIMITS['sms'] = rate
+    ratelimit._buckets.clear()
+    providers.get_bucket('sms', rate, db_path=db_path)
+
+    deadline = time.monotonic() + seconds
+
+    def loop():
+        while time.monotonic() < deadline:
+            providers.send_sms("Load test", "+919876543210")
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def run(label, provider, url, rate, provider_rate, seconds, threads=8, processes=1, db_path=''):
+    provider.reset(provider_rate)
+    start = time.monotonic()
+    if processes <= 1:
+        _send_for(url, rate, db_path, seconds, threads)
+    else:
+        children = [
+            multiprocessing.Process(target=_send_for, args=(url, rate, db_path, seconds, threads))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+
+    steady = [accepted for at, accepted in provider.events if at - start >= WARMUP]
+    window = max(time.monotonic() - start - WARMUP, 1e-9)
+    return {
+        'scenario': label,
+        'channel_rate': rate,
+        'provider_rate': provider_rate,
+        'processes': processes,
+        'accepted_per_s': round(sum(steady) / window, 2),
+        'throttled_per_s': round((len(steady) - sum(steady)) / window, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=6.0)
+    parser.add_argument('--rate', type=float, default=20.0, help="RATE_LIMIT_SMS for the run (requests/second)")
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    # Every throttled send logs an error; keep the report readable
+    logging.getLogger().setLevel(logging.CRITICAL)
+    ratelimit.RATE_LIMIT_COOLDOWN = 0.5
+
+    provider = SimulatedProvider(args.rate * 10)
+    threading.Thread(target=provider.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{provider.server_port}/dev/bulkV2"
+    db_path = os.path.join(tempfile.mkdtemp(), 'ratelimit.db')
+    rate = args.rate
+
+    results = [
+        run('ceiling', provider, url, rate, rate * 10, args.seconds),
+        run('adaptive', provider, url, rate * 2, rate / 2, args.seconds),
+        run('shared', provider, url, rate, rate * 10, args.seconds, threads=4, processes=3, db_path=db_path),
+    ]
+    print(json.dumps(results, indent=2))
+
+    ceiling, adaptive, shared = results
+    checks = {
+        'ceiling held': abs(ceiling['accepted_per_s'] - rate) <= rate * args.tolerance,
+        'adaptive tracks provider': adaptive['accepted_per_s'] >= rate / 2 * (1 - args.tolerance)
+                                    and adaptive['throttled_per_s'] <= adaptive['accepted_per_s'],
+        'shared across processes': abs(shared['accepted_per_s'] - rate) <= rate * args.tolerance,
+    }
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'}: {name}")
+
+    provider.shutdown()
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Micro-benchmark: per-call latency of bare requests.post vs the pooled transport.
+
+Starts a local keep-alive HTTP stub (optionally slow to accept, to stand in for
+DNS + TCP + TLS setup) and POSTs to it sequentially with both clients.
+
+    python benchmarks/bench_transport.py --calls 500 --connect-delay-ms 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import transport  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections open between requests
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"return": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    connect_delay = 0.0
+
+    def finish_request(self, request, client_address):
+        # Charged once per new connection, like a handshake
+        time.sleep(self.connect_delay)
+        super().finish_request(request, client_address)
+
+
+def run(label, post, url, calls):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        response = post(url, data={'numbers': '+919876543210', 'message': 'hi'})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    return {
+        'client': label,
+        'calls': calls,
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'p50_ms': round(latencies[len(latencies) // 2], 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=300)
+    parser.add_argument('--connect-delay-ms', type=float, default=0.0,
+                        help="extra delay per new connection (simulated handshake)")
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    server.connect_delay = args.connect_delay_ms / 1000
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/dev/bulkV2"
+
+    results = [
+        run('requests.post', requests.post, url, args.calls),
+        run('transport.post', transport.post, url, args.calls),
+    ]
+    print(json.dumps(results, indent=2))
+
+    server.shutdown()
+    transport.close_sessions()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""
+End-to-end load test of the campaign pipeline against local stand-ins for every provider.
+
+Starts, in this process:
+- one HTTP stub answering as Fast2SMS, Exotel, Twilio and Perplexity;
+- an SMTP sink;
+each with configurable latency and error rate (errors are 503s / SMTP 451s, so the
+retry path is exercised). The app runs in a child process (web server plus inline
+worker) whose provider URLs point at the stubs. For each mode and sheet size it
+uploads a synthetic sheet to /trigger and polls the job until it finishes, then fires
+concurrent /generate-message requests.
+
+Reports JSON: campaign throughput (contacts/minute), /trigger and per-recipient
+delivery latency percentiles, /generate-message latency percentiles and the app
+process's peak RSS.
+
+    python benchmarks/loadtest.py --modes sms email whatsapp call --sizes 1000 10000 \\
+        --latency-ms 50 --error-rate 0.01 --output loadtest.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import resource
+import tempfile
+import threading
+import socketserver
+import multiprocessing
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_parse_excel import write_sheet  # noqa: E402
+
+# Which stub traffic belongs to which campaign mode
+MODE_PROVIDERS = {'sms': 'fast2sms', 'call': 'exotel', 'whatsapp': 'twilio', 'email': 'smtp', 'null': None}
+
+LLM_TEMPLATE = "Hello {name}, this is a load test message from the campaign pipeline."
+
+
+class ProviderStub(ThreadingHTTPServer):
+    """
+    Fast2SMS, Exotel, Twilio and Perplexity on one port, told apart by path.
+    latency and error_rate are dicts keyed by provider name.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency, error_rate):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.events = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def record(self, provider, recipients, ok):
+        with self._lock:
+            self.events.append((time.time(), provider, recipients, ok))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.endswith('/dev/bulkV2'):
+            provider = 'fast2sms'
+            recipients = len(parse_qs(body.decode()).get('numbers', [''])[0].split(','))
+        elif self.path.endswith('/Calls/connect'):
+            provider, recipients = 'exotel', 1
+        elif self.path.endswith('/Messages.json'):
+            provider, recipients = 'twilio', 1
+        elif self.path.endswith('/chat/completions'):
+            provider, recipients = 'perplexity', 0
+        else:
+            self._reply(404, {'error': 'unknown path'})
+            return
+
+        time.sleep(self.server.latency.get(provider, 0))
+        ok = random.random() >= self.server.error_rate.get(provider, 0)
+        self.server.record(provider, recipients, ok)
+        if not ok:
+            self._reply(503, {'message': 'simulated outage'})
+        elif provider == 'fast2sms':
+            self._reply(200, {'return': True, 'request_id': f"lt{random.randrange(10 ** 9)}"})
+        elif provider == 'exotel':
+            self._reply(200, {'Call': {'Sid': f"lt{random.randrange(10 ** 9)}", 'Status': 'in-progress'}})
+        elif provider == 'twilio':
+            sid = f"SM{random.randrange(16 ** 32):032x}"
+            self._reply(201, {'sid': sid, 'status': 'queued', 'body': '', 'num_segments': '1'})
+        else:
+            self._completion(json.loads(body or b'{}'))
+
+    def _completion(self, request):
+        if not request.get('stream'):
+            self._reply(200, {'choices': [{'message': {'role': 'assistant', 'content': LLM_TEMPLATE}}]})
+            return
+        events = b''.join(
+            f"data: {json.dumps({'choices': [{'delta': {'content': word + ' '}}]})}\n\n".encode()
+            for word in LLM_TEMPLATE.split()
+        ) + b"data: [DONE]\n\n"
+        self._reply(200, events, content_type='text/event-stream')
+
+    def log_message(self, *args):
+        pass
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Minimal SMTP server: accepts and discards every message, after `latency`
+    seconds, answering 451 (temporary failure) for an `error_rate` fraction.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, latency, error_rate, stub):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stub = stub
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"220 loadtest ESMTP\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.wfile.write(b"250-loadtest\r\n250 8BITMIME\r\n")
+            elif command == b'DATA':
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b".\r\n":
+                        break
+                time.sleep(self.server.latency)
+                ok = random.random() >= self.server.error_rate
+                self.server.stub.record('smtp', 1, ok)
+                self.wfile.write(b"250 2.0.0 Queued\r\n" if ok else b"451 4.3.0 Try again later\r\n")
+            elif command == b'QUIT':
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self.wfile.write(b"250 OK\r\n")
+
+
+def _serve_app(port, env, results):
+    """
+    Child process: the Flask app plus an inline worker, configured by env.
+    Reports its peak RSS when terminated.
+    """
+    os.environ.update(env)
+
+    def stop(*args):
+        # ru_maxrss is KiB on Linux
+        results.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        results.close()
+        results.join_thread()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    import logging
+    from werkzeug.serving import make_server
+    import app
+    from worker import start_inline_worker
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    start_inline_worker()
+    make_server('127.0.0.1', port, app.app, threaded=True).serve_forever()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(p):
+        return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 2)
+    return {'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'max': round(values[-1], 2)}
+
+
+def app_env(args, stub, smtp, tmp):
+    rate_limits = {} if args.keep_rate_limits else {
+        f"RATE_LIMIT_{mode.upper()}": '0' for mode in ('sms', 'email', 'whatsapp', 'call')
+    }
+    return dict(
+        rate_limits,
+        FAST2SMS_URL=f"{stub.url}/dev/bulkV2", FAST2SMS_API_KEY='loadtest',
+        EXOTEL_API_URL=stub.url, EXOTEL_SID='loadtest', EXOTEL_TOKEN='loadtest',
+        EXOPHONE='+910000000000', EXOTEL_FROM='+910000000000',
+        TWILIO_API_URL=stub.url, TWILIO_SID='ACloadtest', TWILIO_TOKEN='loadtest',
+        PERPLEXITY_API_URL=f"{stub.url}/chat/completions", PERPLEXITY_API_KEY='loadtest',
+        LLM_REQUESTS_PER_MINUTE=str(args.llm_rpm),
+        EMAIL_ADDRESS='loadtest@example.com', EMAIL_PASSWORD='loadtest',
+        SMTP_HOST='127.0.0.1', SMTP_PORT=str(smtp.server_address[1]), SMTP_USE_TLS='false',
+        JOBS_DB=os.path.join(tmp, 'jobs.db'), JOBS_SPOOL_DIR=os.path.join(tmp, 'job_files'),
+        UPLOAD_SPOOL_DIR=os.path.join(tmp, 'uploads'), CONTACT_STORE_DB=os.path.join(tmp, 'contacts.db'),
+        LEDGER_DB=os.path.join(tmp, 'ledger.db'), RATE_LIMIT_DB=os.path.join(tmp, 'ratelimit.db'),
+        METRICS_DIR=os.path.join(tmp, 'metrics'), SCHEDULER_DB=os.path.join(tmp, 'scheduler.db'),
+        RETRY_BASE_DELAY='0.2', WORKER_POLL_INTERVAL='0.1', WORKER_PROGRESS_INTERVAL='0.5',
+        NULL_CHANNEL_LATENCY_MS=str(args.latency_ms), NULL_CHANNEL_FAILURE_RATE=str(args.error_rate),
+    )
+
+
+class AppProcess:
+    def __init__(self, env):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._results = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve_app, args=(self.port, env, self._results))
+
+    def __enter__(self):
+        self._process.start()
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                requests.get(self.url, timeout=1)
+                return self
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        raise RuntimeError("App did not start")
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self.peak_rss_mb = round(self._results.get(timeout=10), 1)
+        self._process.join()
+
+
+def run_campaign(app, stub, mode, sheet, size, use_custom, timeout):
+    since = time.time()
+    with open(sheet, 'rb') as f:
+        start = time.perf_counter()
+        response = requests.post(
+            f"{app.url}/trigger",
+            files={'excel_file': (os.path.basename(sheet), f)},
+            data={'mode': mode, 'use_custom': use_custom, 'user_message': 'Exam results are out', 'email_subject': 'Results'},
+            allow_redirects=False,
+        )
+        trigger_ms = (time.perf_counter() - start) * 1000
+    location = response.headers.get('Location', '')
+    if '/jobs/' not in location:
+        return {'mode': mode, 'size': size, 'error': f"/trigger answered {response.status_code} -> {location!r}"}
+    job_id = location.rstrip('/').rsplit('/', 1)[-1]
+
+    deadline = time.monotonic() + timeout
+    while True:
+        job = requests.get(f"{app.url}/api/jobs/{job_id}").json()
+        if job['status'] in ('done', 'failed') or time.monotonic() > deadline:
+            break
+        time.sleep(0.1)
+    seconds = time.time() - since
+
+    provider = MODE_PROVIDERS.get(mode)
+    deliveries = []
+    requests_made = errors = 0
+    for at, name, recipients, ok in list(stub.events):
+        if name != provider or at < since:
+            continue
+        requests_made += 1
+        errors += not ok
+        if ok:
+            deliveries.extend([(at - since) * 1000] * recipients)
+
+    processed = job['sent'] + job['failed']
+    return {
+        'mode': mode,
+        'size': size,
+        'use_custom': use_custom,
+        'status': job['status'],
+        'error': job.get('error'),
+        'sent': job['sent'],
+        'failed': job['failed'],
+        'dead_letters': len(job.get('dead_letters') or []),
+        'seconds': round(seconds, 3),
+        'contacts_per_minute': round(processed / seconds * 60) if seconds else None,
+        'trigger_ms': round(trigger_ms, 2),
+        'delivery_ms': _percentiles(deliveries),
+        'provider_requests': requests_made,
+        'provider_errors': errors,
+    }
+
+
+def run_generate(app, count, concurrency):
+    def call(idx):
+        start = time.perf_counter()
+        response = requests.post(
+            f"{app.url}/generate-message",
+            json={'mode': 'email', 'user_message': f"Reminder number {idx} about fee payment", 'subject': 'Fees'},
+        )
+        return (time.perf_counter() - start) * 1000, response.status_code == 200 and 'message' in response.json()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(count)))
+    seconds = time.perf_counter() - start
+    return {
+        'endpoint': '/generate-message',
+        'requests': count,
+        'concurrency': concurrency,
+        'ok': sum(ok for _, ok in results),
+        'requests_per_second': round(count / seconds, 2),
+        'latency_ms': _percentiles([ms for ms, _ in results]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['sms', 'email', 'whatsapp', 'call'],
+                        choices=sorted(MODE_PROVIDERS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000])
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv'])
+    parser.add_argument('--auto-generate', action='store_true', help="LLM-generated content (use_custom=no)")
+    parser.add_argument('--latency-ms', type=float, default=50, help="HTTP provider and SMTP latency")
+    parser.add_argument('--llm-latency-ms', type=float, default=500)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of provider calls that fail transiently")
+    parser.add_argument('--llm-rpm', type=float, default=0, help="LLM_REQUESTS_PER_MINUTE for the app (0 = unlimited)")
+    parser.add_argument('--keep-rate-limits', action='store_true', help="keep the app's RATE_LIMIT_* defaults")
+    parser.add_argument('--generate-requests', type=int, default=50)
+    parser.add_argument('--generate-concurrency', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=600, help="seconds to wait for each campaign")
+    parser.add_argument('--output', help="also write the JSON report here")
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    stub = ProviderStub(
+        latency={'fast2sms': latency, 'exotel': latency, 'twilio': latency, 'perplexity': args.llm_latency_ms / 1000},
+        error_rate={'fast2sms': args.error_rate, 'exotel': args.error_rate, 'twilio': args.error_rate},
+    )
+    smtp = SMTPSink(latency, args.error_rate, stub)
+    for server in (stub, smtp):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    report = {
+        'config': vars(args),
+        'campaigns': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        sheets = {}
+        for size in args.sizes:
+            sheets[size] = os.path.join(tmp, f"contacts_{size}.{args.format}")
+            write_sheet(sheets[size], args.format, size)
+
+        # A fresh app process per campaign, so peak RSS is that campaign's
+        for mode in args.modes:
+            for size in args.sizes:
+                with AppProcess(app_env(args, stub, smtp, tempfile.mkdtemp(dir=tmp))) as app:
+                    result = run_campaign(
+                        app, stub, mode, sheets[size], size, 'no' if args.auto_generate else 'yes', args.timeout
+                    )
+                result['peak_rss_mb'] = app.peak_rss_mb
+                report['campaigns'].append(result)
+                print(json.dumps(result), file=sys.stderr)
+
+        if args.generate_requests:
+            with AppProcess(app_env(args, stub, smtp, tempfile.mkdtemp(dir=tmp))) as app:
+                result = run_generate(app, args.generate_requests, args.generate_concurrency)
+            result['peak_rss_mb'] = app.peak_rss_mb
+            report['generate'] = result
+            print(json.dumps(result), file=sys.stderr)
+
+    stub.shutdown()
+    smtp.shutdown()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
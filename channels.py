@@ -0,0 +1,206 @@
+"""
+Channel registry: one class per delivery channel, instantiated once per process.
+
+A channel knows which contact field it sends to, how to validate a recipient, what to
+set up once per campaign (prepare), and how to send one message or a batch of
+identical ones. Adding a channel means registering a subclass here; app.py and the
+dispatcher pick it up by its name (the campaign "mode").
+"""
+import os
+import copy
+import random
+import asyncio
+from dotenv import load_dotenv
+
+import main
+import event_loop
+import async_senders
+from smtp_pool import SMTPPool, AsyncSMTPPool
+from attachments import prepare_attachments
+
+load_dotenv()
+
+# Loopback channel for load tests: simulated provider latency and failure rate
+NULL_CHANNEL_LATENCY_MS = float(os.getenv('NULL_CHANNEL_LATENCY_MS', '0'))
+NULL_CHANNEL_FAILURE_RATE = float(os.getenv('NULL_CHANNEL_FAILURE_RATE', '0'))
+
+CHANNELS = {}
+
+
+def register(cls):
+    CHANNELS[cls.name] = cls()
+    return cls
+
+
+class Channel:
+    """
+    Base channel. Subclasses set `name` and `field` and implement send_async(), or
+    send() for a channel with only a blocking client (it is then run on a thread).
+
+    - validate(value): error message for a bad recipient, or None.
+    - prepare(...): campaign-scoped copy holding anything reused by every send
+      (pooled sessions, encoded attachments); close() releases it.
+    - send_async(content, value, name=None): one message on the event loop, returns
+      (success, message). send() is its blocking wrapper.
+    - send_batch_async(content, values): the same text to several recipients; channels
+      with a bulk API set `batch_size` (recipients per call) and override it.
+      send_batch() is its blocking wrapper.
+    """
+    name = None
+    field = 'phone'
+    batch_size = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.send is Channel.send and cls.send_async is Channel.send_async:
+            raise TypeError(f"Channel {cls.__name__} must implement send_async() or send()")
+
+    def validate(self, value):
+        if not main.is_valid_phone(value):
+            return f"Invalid phone number: {value}"
+        return None
+
+    def prepare(self, subject=None, attachments=None, concurrency=None, smtp_pool=None):
+        return copy.copy(self)
+
+    def send(self, content, value, name=None):
+        return event_loop.run(self.send_async(content, value, name=name))
+
+    async def send_async(self, content, value, name=None):
+        # Only a blocking send() is implemented: keep it off the event loop
+        return await asyncio.to_thread(self.send, content, value, name=name)
+
+    def send_batch(self, content, values):
+        return event_loop.run(self.send_batch_async(content, values))
+
+    async def send_batch_async(self, content, values):
+        return list(await asyncio.gather(*(self.send_async(content, value) for value in values)))
+
+    def close(self):
+        event_loop.run(self.close_async())
+
+    async def close_async(self):
+        pass
+
+
+@register
+class SMSChannel(Channel):
+    name = 'sms'
+    batch_size = main.FAST2SMS_CHUNK_SIZE
+
+    async def send_async(self, content, value, name=None):
+        return await async_senders.send_sms_async(content, value)
+
+    async def send_batch_async(self, content, values):
+        # One Fast2SMS request for the whole batch
+        return await async_senders.send_sms_bulk_async(content, values, chunk_size=len(values))
+
+
+@register
+class EmailChannel(Channel):
+    name = 'email'
+    field = 'email'
+
+    def __init__(self):
+        self.subject = None
+        self.attachments = []
+        self.smtp_pool = None
+        self._owns_pool = False
+
+    def validate(self, value):
+        if not main.is_valid_email(value):
+            return f"Invalid email address: {value}"
+        return None
+
+    def prepare(self, subject=None, attachments=None, concurrency=None, smtp_pool=None):
+        prepared = copy.copy(self)
+        prepared.subject = subject
+        # Encode once; every email in the campaign shares the same MIME parts
+        prepared.attachments = prepare_attachments(attachments)
+        prepared._owns_pool = smtp_pool is None
+        # A sync caller's SMTPPool is used through the async pool behind it
+        if isinstance(smtp_pool, SMTPPool):
+            smtp_pool = smtp_pool.pool
+        prepared.smtp_pool = smtp_pool or AsyncSMTPPool(size=concurrency)
+        return prepared
+
+    async def send_async(self, content, value, name=None):
+        return await async_senders.send_email_async(
+            name or "User", value, content,
+            subject=self.subject, attachments=self.attachments, smtp_pool=self.smtp_pool
+        )
+
+    async def close_async(self):
+        if self._owns_pool and self.smtp_pool is not None:
+            await self.smtp_pool.close()
+
+
+@register
+class WhatsAppChannel(Channel):
+    name = 'whatsapp'
+
+    def validate(self, value):
+        if not main.is_valid_phone(value):
+            return f"Invalid WhatsApp number: {value}"
+        return None
+
+    async def send_async(self, content, value, name=None):
+        return await async_senders.send_whatsapp_async(content, value)
+
+
+@register
+class CallChannel(Channel):
+    name = 'call'
+
+    def validate(self, value):
+        if not main.is_valid_phone(value):
+            return f"Invalid phone number for call: {value}"
+        return None
+
+    async def send_async(self, content, value, name=None):
+        return await async_senders.handle_call_async(content, value)
+
+
+@register
+class NullChannel(Channel):
+    """
+    Loopback channel for load tests: accepts any well-formed phone number and sends
+    nothing, after NULL_CHANNEL_LATENCY_MS. A NULL_CHANNEL_FAILURE_RATE fraction of
+    sends fail as a provider 503, which exercises the retry path.
+    """
+    name = 'null'
+
+    async def send_async(self, content, value, name=None):
+        if NULL_CHANNEL_LATENCY_MS:
+            await asyncio.sleep(NULL_CHANNEL_LATENCY_MS / 1000)
+        if NULL_CHANNEL_FAILURE_RATE and random.random() < NULL_CHANNEL_FAILURE_RATE:
+            return False, "Null send failed (HTTP 503): simulated outage"
+        return True, f"Null send to {value}"
+
+
+def get_channel(mode):
+    """
+    Returns the registered channel for a mode, or None.
+    """
+    return CHANNELS.get(mode)
+
+
+def contact_field(mode):
+    """
+    The contact field ('phone' or 'email') a mode sends to.
+    """
+    channel = CHANNELS.get(mode)
+    return channel.field if channel is not None else 'email'
+
+
+def dispatch_message(mode, content, contact, name=None, subject=None, attachments=None, smtp_pool=None):
+    """
+    Send one message through the mode's channel (blocking wrapper around
+    async_senders.dispatch_message_async).
+    - name personalizes email.
+    - subject, attachments and smtp_pool are used only by channels that need them (email).
+    - Pass an SMTPPool as smtp_pool to reuse sessions across a whole batch.
+    """
+    return event_loop.run(async_senders.dispatch_message_async(
+        mode, content, contact, name=name, subject=subject, attachments=attachments, smtp_pool=smtp_pool
+    ))
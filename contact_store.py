@@ -0,0 +1,427 @@
+"""
+Persistent contact store: a sheet is ingested once into SQLite, then campaigns can
+target the saved list (or a filtered subset of it) without re-parsing any Excel.
+
+Lists are versioned by name. Saving a list again loads a new version alongside the
+current one and switches over only when the load completes; the version it replaces is
+kept until the next save, so a campaign already reading it is not cut short.
+Phones are stored in E.164 and emails lower-cased, with indexes on both, so lookups
+and de-duplication are index operations.
+
+Each stored row carries a hash of its normalized fields, so a re-uploaded version of a
+list can be compared with an earlier one row by row (delta campaigns). A delta campaign
+compares against a baseline: a copy of the earlier version's hashes taken when it is
+queued, so it still has them when it is resumed after that version has been replaced.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+import pandas as pd
+from dotenv import load_dotenv
+
+from utils import CONTACT_CHUNK_SIZE
+from validation import normalize_phones, normalize_emails
+
+load_dotenv()
+
+CONTACT_STORE_DB = os.getenv('CONTACT_STORE_DB', 'contacts.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contact_lists (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    sheet_digest TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_contact_lists_name ON contact_lists (name, status);
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY,
+    list_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    email TEXT NOT NULL,
+    row_hash TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_contacts_row ON contacts (list_id, phone, email, name);
+CREATE INDEX IF NOT EXISTS idx_contacts_phone ON contacts (phone);
+CREATE INDEX IF NOT EXISTS idx_contacts_email ON contacts (email);
+CREATE TABLE IF NOT EXISTS baselines (
+    id INTEGER PRIMARY KEY,
+    list_id INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS baseline_hashes (
+    baseline_id INTEGER NOT NULL,
+    row_hash TEXT NOT NULL,
+    PRIMARY KEY (baseline_id, row_hash)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS list_saves (
+    job_id TEXT PRIMARY KEY,
+    list_id INTEGER NOT NULL,
+    saved_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first release: (table, name, type) for ALTER TABLE on older databases
+_ADDED_COLUMNS = [('contacts', 'row_hash', 'TEXT')]
+
+# List versions
+LOADING = 'loading'
+READY = 'ready'
+
+
+class Contact:
+    """
+    One stored contact. Far smaller than a dict per row; get() lets it stand in
+    where code reads contact fields by name.
+    """
+    __slots__ = ('id', 'name', 'phone', 'email')
+
+    def __init__(self, id, name, phone, email):
+        self.id = id
+        self.name = name
+        self.phone = phone
+        self.email = email
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def to_dict(self):
+        # The form the dispatcher and job payloads use
+        return {'name': self.name, 'phone': self.phone, 'email': self.email}
+
+    def __repr__(self):
+        return f"Contact({self.id}, {self.name!r}, {self.phone!r}, {self.email!r})"
+
+
+def _normalize(contacts):
+    """
+    Rows as stored: phone in E.164 where it can be normalized (kept as given otherwise,
+    so validation can still report it) and email lower-cased.
+    """
+    df = pd.DataFrame(contacts, columns=['name', 'phone', 'email']).fillna('')
+    phones = normalize_phones(df['phone'])
+    df['phone'] = phones.where(phones != '', df['phone'].astype(str).str.strip())
+    df['email'] = normalize_emails(df['email'])
+    df['name'] = df['name'].astype(str).str.strip()
+    return list(zip(df['name'], df['phone'], df['email']))
+
+
+def _row_hash(row):
+    # 64 bits is plenty to tell rows of one list apart and keeps the in-memory set small
+    return hashlib.blake2b('\x1f'.join(row).encode(), digest_size=8).hexdigest()
+
+
+def _filter_sql(filters):
+    """
+    WHERE clause (after list_id) and parameters for a campaign's contact filter:
+    name (substring), email_domain, phone_prefix.
+    """
+    clauses = []
+    params = []
+    filters = filters or {}
+    if filters.get('name'):
+        clauses.append("name LIKE ?")
+        params.append(f"%{filters['name']}%")
+    if filters.get('email_domain'):
+        clauses.append("email LIKE ?")
+        params.append(f"%@{filters['email_domain'].lstrip('@').lower()}")
+    if filters.get('phone_prefix'):
+        clauses.append("phone LIKE ?")
+        params.append(f"{filters['phone_prefix']}%")
+    return ''.join(f" AND {clause}" for clause in clauses), params
+
+
+class ContactStore:
+    """
+    Saved contact lists in SQLite. One instance may be shared by threads.
+    """
+
+    def __init__(self, db_path=None):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path or CONTACT_STORE_DB, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        for table, column, column_type in _ADDED_COLUMNS:
+            columns = {row['name'] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _current(self, name):
+        return self._conn.execute(
+            "SELECT * FROM contact_lists WHERE name = ? AND status = ? ORDER BY id DESC LIMIT 1", (name, READY)
+        ).fetchone()
+
+    def get_list(self, name):
+        """
+        Returns the list's current version as a dict (id, name, size, sheet_digest, created_at), or None.
+        """
+        with self._lock:
+            row = self._current(name)
+        return dict(row) if row is not None else None
+
+    def lists(self):
+        """
+        Every saved list's current version, newest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM contact_lists WHERE id IN "
+                "(SELECT MAX(id) FROM contact_lists WHERE status = ? GROUP BY name) ORDER BY created_at DESC",
+                (READY,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def row_hashes(self, version_id):
+        """
+        The set of row hashes in one list version (see get_list()['id']).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_hash, name, phone, email FROM contacts WHERE list_id = ?", (version_id,)
+            ).fetchall()
+        # Rows stored before hashes were recorded are hashed here
+        return {row['row_hash'] or _row_hash((row['name'], row['phone'], row['email'])) for row in rows}
+
+    def snapshot(self, version_id):
+        """
+        Copy one list version's row hashes into a baseline that outlives the version.
+        Returns the baseline id.
+        """
+        hashes = self.row_hashes(version_id)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            baseline_id = self._conn.execute(
+                "INSERT INTO baselines (list_id, created_at) VALUES (?, ?)", (version_id, time.time())
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO baseline_hashes (baseline_id, row_hash) VALUES (?, ?)",
+                [(baseline_id, row_hash) for row_hash in hashes]
+            )
+            self._conn.execute("COMMIT")
+        return baseline_id
+
+    def baseline_hashes(self, baseline_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_hash FROM baseline_hashes WHERE baseline_id = ?", (baseline_id,)
+            ).fetchall()
+        return {row['row_hash'] for row in rows}
+
+    def saved_by(self, job_id):
+        """
+        Whether the job has already saved its list (in an earlier run).
+        """
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM list_saves WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def forget_job(self, job_id, baseline_id=None):
+        """
+        Drop what the store keeps for a job that can no longer be resumed.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM list_saves WHERE job_id = ?", (job_id,))
+            if baseline_id is not None:
+                self._conn.execute("DELETE FROM baseline_hashes WHERE baseline_id = ?", (baseline_id,))
+                self._conn.execute("DELETE FROM baselines WHERE id = ?", (baseline_id,))
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _split_changed(contacts, hashes, previous, on_unchanged):
+        changed = []
+        unchanged = []
+        for contact, row_hash in zip(contacts, hashes):
+            (unchanged if row_hash in previous else changed).append(contact)
+        if unchanged and on_unchanged is not None:
+            on_unchanged(unchanged)
+        return changed
+
+    def changed(self, chunks, baseline=None, on_unchanged=None):
+        """
+        Delta filtering without saving: yields only rows not in the baseline (every row
+        without one), passing the rest to on_unchanged(contacts).
+        """
+        previous = self.baseline_hashes(baseline) if baseline is not None else None
+        for contacts in chunks:
+            if previous is None:
+                yield contacts
+                continue
+            changed = self._split_changed(
+                contacts, [_row_hash(row) for row in _normalize(contacts)], previous, on_unchanged
+            )
+            if changed:
+                yield changed
+
+    def ingest(self, name, chunks, sheet_digest=None, baseline=None, on_unchanged=None, job_id=None):
+        """
+        Save chunks of contact dicts as a new version of the named list, yielding each
+        chunk as it is stored so a campaign can send while the list loads.
+        The new version replaces the old one once every chunk has been consumed; with a
+        job_id, the store also records that this job saved it (see saved_by).
+
+        Delta mode: with a baseline (see snapshot), every row is still saved but rows
+        identical to one in the baseline are not yielded; on_unchanged(contacts) gets
+        them instead, so only added or changed contacts are sent.
+        """
+        previous = self.baseline_hashes(baseline) if baseline is not None else None
+        with self._lock:
+            list_id = self._conn.execute(
+                "INSERT INTO contact_lists (name, status, sheet_digest, created_at) VALUES (?, ?, ?, ?)",
+                (name, LOADING, sheet_digest, time.time())
+            ).lastrowid
+
+        complete = False
+        try:
+            for contacts in chunks:
+                rows = _normalize(contacts)
+                hashes = [_row_hash(row) for row in rows]
+                with self._lock:
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO contacts (list_id, name, phone, email, row_hash) VALUES (?, ?, ?, ?, ?)",
+                        [(list_id,) + row + (row_hash,) for row, row_hash in zip(rows, hashes)]
+                    )
+                    self._conn.execute("COMMIT")
+
+                if previous is None:
+                    yield contacts
+                    continue
+                changed = self._split_changed(contacts, hashes, previous, on_unchanged)
+                if changed:
+                    yield changed
+            complete = True
+        finally:
+            self._finish(name, list_id, complete, job_id)
+
+    def _delete_versions(self, where, params):
+        self._conn.execute(f"DELETE FROM contacts WHERE list_id IN (SELECT id FROM contact_lists WHERE {where})", params)
+        return self._conn.execute(f"DELETE FROM contact_lists WHERE {where}", params).rowcount
+
+    def _finish(self, name, list_id, complete, job_id=None):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if complete:
+                    size = self._conn.execute("SELECT COUNT(*) FROM contacts WHERE list_id = ?", (list_id,)).fetchone()[0]
+                    self._conn.execute(
+                        "UPDATE contact_lists SET status = ?, size = ? WHERE id = ?", (READY, size, list_id)
+                    )
+                    # Keep the version just replaced (campaigns may still be reading it); drop anything older
+                    self._delete_versions(
+                        "name = ? AND id < (SELECT MAX(id) FROM contact_lists WHERE name = ? AND status = ? AND id < ?)",
+                        (name, name, READY, list_id)
+                    )
+                    if job_id is not None:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO list_saves (job_id, list_id, saved_at) VALUES (?, ?, ?)",
+                            (job_id, list_id, time.time())
+                        )
+                else:
+                    # An interrupted load is dropped; the current version stays current
+                    self._delete_versions("id = ?", (list_id,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if complete:
+            logging.info(f"Saved contact list '{name}' ({size} contact(s))")
+
+    def save_list(self, name, chunks, sheet_digest=None):
+        """
+        Ingest every chunk. Returns the saved list as get_list() does.
+        """
+        for _ in self.ingest(name, chunks, sheet_digest=sheet_digest):
+            pass
+        return self.get_list(name)
+
+    def count(self, name, filters=None):
+        with self._lock:
+            current = self._current(name)
+            if current is None:
+                return 0
+            where, params = _filter_sql(filters)
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM contacts WHERE list_id = ?{where}", [current['id']] + params
+            ).fetchone()[0]
+
+    def iter_contacts(self, name, filters=None, chunk_size=None):
+        """
+        Stream a saved list (optionally filtered) as lists of contact dicts, in the
+        chunks the dispatcher takes. Raises ValueError if there is no such list.
+        """
+        chunk_size = chunk_size or CONTACT_CHUNK_SIZE
+        with self._lock:
+            current = self._current(name)
+        if current is None:
+            raise ValueError(f"No saved contact list named '{name}'")
+
+        where, params = _filter_sql(filters)
+        last_id = 0
+        while True:
+            # Keyset pagination: each page is one indexed range scan
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, name, phone, email FROM contacts WHERE list_id = ? AND id > ?{where} "
+                    f"ORDER BY id LIMIT ?",
+                    [current['id'], last_id] + params + [chunk_size]
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield [{'name': row['name'], 'phone': row['phone'], 'email': row['email']} for row in rows]
+
+    def find(self, phone=None, email=None):
+        """
+        Indexed lookup across every saved list's current version.
+        Returns a list of (list name, Contact).
+        """
+        clauses = []
+        params = []
+        if phone:
+            phones = normalize_phones(pd.Series([phone]))
+            clauses.append("c.phone = ?")
+            params.append(phones[0] or phone)
+        if email:
+            clauses.append("c.email = ?")
+            params.append(email.strip().lower())
+        if not clauses:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT l.name AS list_name, c.id, c.name, c.phone, c.email "
+                "FROM contacts c JOIN contact_lists l ON l.id = c.list_id "
+                "WHERE l.id IN (SELECT MAX(id) FROM contact_lists WHERE status = ? GROUP BY name) "
+                f"AND {' AND '.join(clauses)}",
+                [READY] + params
+            ).fetchall()
+        return [(row['list_name'], Contact(row['id'], row['name'], row['phone'], row['email'])) for row in rows]
+
+    def delete_list(self, name):
+        """
+        Remove every version of a list. Returns whether it existed.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            deleted = self._delete_versions("name = ?", (name,))
+            self._conn.execute("COMMIT")
+        return deleted > 0
+
+    def close(self):
+        self._conn.close()
@@ -1,67 +1,308 @@
 # content.py
 
 import os
+import time
+import logging
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 
+import transport
+import metrics
+from llm_cache import cache, cache_key, LLM_CACHE_ENABLED
+from ratelimit import RateLimiter
+
 # Load API key from .env
 load_dotenv()
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
+PERPLEXITY_URL = os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
+PERPLEXITY_MODEL = "sonar-pro"
+TEMPERATURE = 0.7
 
+SYSTEM_PROMPT = "You are a helpful assistant for university counseling team to student about admission opened."
 
-def generate_content(mode, user_need, subject=None, recipient_name=None, complexity='medium'):
-    if not PERPLEXITY_API_KEY:
-        return "[ERROR] Missing Perplexity API key in environment."
+# Placeholder the model must leave in a template so it can be personalized locally
+NAME_PLACEHOLDER = "{name}"
 
-    name = recipient_name or "Student"
+# Perplexity budgets shared by every completion in this process (0 disables a budget)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "50"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+# Rough completion size charged against the tokens-per-minute budget
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "400"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
 
-    # User-facing prompt
-    user_prompt = (
+# 429s come back to us so the limiter and Retry-After handling below see them; a completion
+# is safe to request again, so server errors are retried by the transport
+LLM_RETRY_STATUSES = (500, 502, 503, 504)
+
+_limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+
+
+def _build_prompt(mode, user_need, subject, name, complexity):
+    return (
         f"A university councelling team on {subject}. "
         f"They want to {user_need}. "
         f"Generate a {mode.upper()} message addressed to {name}, using {complexity} complexity. "
         f"Keep it friendly and professional. End with a follow-up offer for support and detailed info about university."
     )
 
-    # Prepare API request
-    url = "https://api.perplexity.ai/chat/completions"
-    headers = {
+
+def _headers():
+    return {
         "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
         "Content-Type": "application/json",
     }
-    payload = {
-        "model": "sonar-pro",  # ✅ Use valid model
+
+
+def _payload(user_prompt):
+    return {
+        "model": PERPLEXITY_MODEL,  # ✅ Use valid model
         "messages": [
-            {"role": "system", "content": "You are a helpful assistant for university counseling team to student about admission opened."},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ],
-        "temperature": 0.7
+        "temperature": TEMPERATURE
     }
 
 
+def _bad_request(response):
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        detail = json.dumps(response.json(), indent=2)
+    except Exception:
+        detail = response.text
+    logging.error(f"Perplexity returned 400 Bad Request: {detail}")
+    return "[ERROR] Bad Request. Check model name or input."
+
+
+def _estimate_tokens(payload):
+    # ~4 characters per token for English prompts
+    prompt_chars = sum(len(message["content"]) for message in payload["messages"])
+    return prompt_chars // 4 + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def _retry_after(response, attempt):
+    """
+    Seconds to wait before retrying a 429: the Retry-After header (seconds or HTTP date)
+    if present, otherwise exponential backoff.
+    """
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return min(2 ** attempt, 30)
+
+
+def _post_completion(payload, stream=False):
+    """
+    POST a completion request under the process-wide rate limiter,
+    waiting out 429 responses. Returns the final response.
+    """
+    body = dict(payload, stream=True) if stream else payload
+    tokens = _estimate_tokens(payload)
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        _limiter.acquire(tokens)
+        # Streamed completions: time to the response headers, not the last token
+        with metrics.timer('llm'):
+            response = transport.post(
+                PERPLEXITY_URL, headers=_headers(), json=body, stream=stream, retry_statuses=LLM_RETRY_STATUSES
+            )
+        if response.status_code != 429 or attempt == LLM_MAX_RETRIES:
+            return response
+
+        delay = _retry_after(response, attempt)
+        response.close()
+        logging.warning(f"Perplexity rate limited, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def _complete(user_prompt, accept=None):
+    """
+    Run one chat completion, served from the LLM cache when possible.
+    accept(text), if given, decides which texts are usable: only those are served from
+    or stored in the cache, so a rejected text is requested afresh next time.
+    Returns the message text, or an "[ERROR] ..." string (errors are never cached).
+    """
+    if not PERPLEXITY_API_KEY:
+        return "[ERROR] Missing Perplexity API key in environment."
+
+    payload = _payload(user_prompt)
+
+    key = cache_key(payload) if LLM_CACHE_ENABLED else None
+    if key:
+        cached = cache.get(key)
+        if cached is not None and accept is not None and not accept(cached):
+            cached = None
+        metrics.LLM_CACHE_REQUESTS.inc(result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return cached
+
+    try:
+        response = _post_completion(payload)
 
         if response.status_code == 400:
-            print("\n[ERROR] 400 Bad Request")
-            try:
-                error_info = response.json()
-                print(json.dumps(error_info, indent=2))
-            except Exception:
-                print(response.text)
-            return "[ERROR] Bad Request. Check model name or input."
+            return _bad_request(response)
 
         response.raise_for_status()
 
         data = response.json()
-        return data["choices"][0]["message"]["content"]
+        text = data["choices"][0]["message"]["content"]
+        if key and (accept is None or accept(text)):
+            cache.set(key, text)
+        return text
 
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] API request failed: {e}")
+        logging.error(f"Perplexity API request failed: {e}")
         return f"[ERROR] Request failed: {e}"
 
 
+def _complete_stream(user_prompt):
+    """
+    Run one chat completion in the API's streaming mode.
+    Yields text deltas as they arrive; a cached completion is yielded in one piece.
+    On failure yields a single "[ERROR] ..." string. Only complete texts are cached.
+    """
+    if not PERPLEXITY_API_KEY:
+        yield "[ERROR] Missing Perplexity API key in environment."
+        return
+
+    payload = _payload(user_prompt)
+
+    # The stream flag is not part of the key: streamed and plain completions share entries
+    key = cache_key(payload) if LLM_CACHE_ENABLED else None
+    if key:
+        cached = cache.get(key)
+        metrics.LLM_CACHE_REQUESTS.inc(result='miss' if cached is None else 'hit')
+        if cached is not None:
+            yield cached
+            return
+
+    try:
+        response = _post_completion(payload, stream=True)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Perplexity API request failed: {e}")
+        yield f"[ERROR] Request failed: {e}"
+        return
+
+    with response:
+        if response.status_code == 400:
+            yield _bad_request(response)
+            return
+        try:
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Perplexity API request failed: {e}")
+            yield f"[ERROR] Request failed: {e}"
+            return
+
+        parts = []
+        try:
+            # Server-Sent Events: "data: {json}" lines, terminated by "data: [DONE]"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+            logging.error(f"Perplexity streaming failed: {e}")
+            yield f"[ERROR] Request failed: {e}"
+            return
+
+    if key and parts:
+        cache.set(key, "".join(parts))
+
+
+def is_error(text):
+    return text.startswith("[ERROR]")
+
+
+def generate_content(mode, user_need, subject=None, recipient_name=None, complexity='medium', stream=False):
+    """
+    Generate a message. With stream=True, returns a generator of text deltas instead of a string.
+    """
+    name = recipient_name or "Student"
+    user_prompt = _build_prompt(mode, user_need, subject, name, complexity)
+    if stream:
+        return _complete_stream(user_prompt)
+    return _complete(user_prompt)
+
+
+def generate_content_many(items, max_in_flight=None, on_item=None):
+    """
+    Run many generate_content calls concurrently, at most max_in_flight at a time,
+    all paced by the shared requests/tokens-per-minute limiter.
+    items: list of generate_content keyword-argument dicts (mode, user_need, recipient_name, ...).
+    on_item(index, (success, text)) is called from the generating thread as each item is done,
+    so callers can use a text without waiting for the whole batch.
+    Returns a list of (success, text) tuples in input order; one failure never aborts the batch.
+    """
+    max_in_flight = max_in_flight or LLM_MAX_IN_FLIGHT
+
+    def generate_one(idx, item):
+        try:
+            text = generate_content(**item)
+            result = not is_error(text), text
+        except Exception as e:
+            result = False, f"[ERROR] {e}"
+        if on_item is not None:
+            try:
+                on_item(idx, result)
+            except Exception:
+                logging.error("Exception in generation callback", exc_info=True)
+        return result
+
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(items)), thread_name_prefix='llm') as executor:
+        return list(executor.map(generate_one, range(len(items)), items))
+
+
+def generate_template(mode, user_need, subject=None, complexity='medium', attempts=2):
+    """
+    Ask the model once for a message addressed to the literal placeholder {name},
+    to be personalized locally for every recipient.
+    Returns the template, or None if the model keeps dropping the placeholder or errors.
+    """
+    user_prompt = (
+        _build_prompt(mode, user_need, subject, NAME_PLACEHOLDER, complexity)
+        + f" Write {NAME_PLACEHOLDER} exactly as shown wherever the recipient's name belongs; "
+        f"it will be replaced later, so do not invent a name."
+    )
+
+    for attempt in range(attempts):
+        # A template without the placeholder is never cached, so each attempt asks the model again
+        template = _complete(user_prompt, accept=lambda text: NAME_PLACEHOLDER in text)
+        if is_error(template):
+            return None
+        if NAME_PLACEHOLDER in template:
+            return template
+        logging.warning(f"Template attempt {attempt + 1} lost the {NAME_PLACEHOLDER} placeholder")
+
+    return None
+
+
+def personalize(template, recipient_name=None):
+    """
+    Fill a template from generate_template for one recipient.
+    Plain replace, not str.format: generated text may contain other braces.
+    """
+    return template.replace(NAME_PLACEHOLDER, recipient_name or "Student")
+
+
 if __name__ == "__main__":
     mode = "email"
     university = "MIT"
@@ -0,0 +1,623 @@
+import os
+import queue
+import asyncio
+import logging
+import weakref
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+from content import generate_content_many, generate_template, personalize
+from channels import get_channel
+from validation import ContactValidator
+from ledger import DeliveryLedger
+from retry import RetryScheduler
+from event_loop import LoopExecutor
+import metrics
+
+load_dotenv()
+
+# Upper bound on sends in flight per campaign (each is a coroutine on the shared event loop)
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '16'))
+
+# Upper bound on in-flight provider calls per channel, shared by every campaign in this process
+CHANNEL_LIMITS = {
+    'sms': int(os.getenv('DISPATCH_LIMIT_SMS', '8')),
+    'email': int(os.getenv('DISPATCH_LIMIT_EMAIL', '4')),
+    'whatsapp': int(os.getenv('DISPATCH_LIMIT_WHATSAPP', '4')),
+    'call': int(os.getenv('DISPATCH_LIMIT_CALL', '2')),
+}
+
+# Auto-generated campaigns: ask the LLM once for a {name} template instead of once per contact
+LLM_TEMPLATE_MODE = os.getenv('LLM_TEMPLATE_MODE', 'true').lower() == 'true'
+
+# Chunks a multi-channel campaign may queue per channel before parsing waits for that channel
+LANE_BACKLOG = int(os.getenv('DISPATCH_LANE_BACKLOG', '2'))
+
+# Auto-generated multi-channel campaigns: contacts generated for at a time, so the channels
+# send each slice while the next one is generated instead of waiting for a whole chunk
+GENERATION_SLICE = int(os.getenv('DISPATCH_GENERATION_SLICE', '50'))
+
+# Per event loop: asyncio semaphores belong to the loop that uses them (a forked worker has its own)
+_channel_slots = weakref.WeakKeyDictionary()
+
+
+def _channel_slot(mode):
+    loop = asyncio.get_running_loop()
+    slots = _channel_slots.get(loop)
+    if slots is None:
+        slots = _channel_slots[loop] = {mode: asyncio.Semaphore(limit) for mode, limit in CHANNEL_LIMITS.items()}
+    return slots.get(mode) or nullcontext()
+
+
+async def process_contact(contact, channel, use_custom, user_message, template=None, generated=None):
+    """
+    Send one message through a prepared channel, on the shared event loop: the user's text,
+    or for auto-generated campaigns a template (a generate_template result, personalized
+    here) or this contact's (success, text) from generate_content_many.
+    Returns a tuple: (success, dispatch message)
+    """
+    mode = channel.name
+    if use_custom == 'yes' and user_message:
+        content = user_message
+    elif use_custom == 'no' and generated is not None:
+        success, content = generated
+        if not success:
+            return False, f"❌ Content generation failed: {content}"
+    elif use_custom == 'no' and template:
+        content = personalize(template, contact.get('name', 'User'))
+    else:
+        return False, "❌ Please enter a message or choose to auto-generate it."
+
+    contact_value = contact.get(channel.field)
+    if not contact_value:
+        return False, f"❌ Contact info missing for mode '{mode}'."
+
+    async with _channel_slot(mode):
+        with metrics.SENDS_IN_FLIGHT.track(channel=mode):
+            return await channel.send_async(content, contact_value, name=contact.get('name', 'User'))
+
+
+def _safe_report(on_result, contact, success, msg):
+    try:
+        on_result(contact, success, msg)
+    except Exception:
+        logging.error("Exception in dispatch result callback", exc_info=True)
+
+
+def _report_when_done(contacts, futures, on_result):
+    if on_result is not None:
+        for contact, future in zip(contacts, futures):
+            future.add_done_callback(
+                lambda done, contact=contact: _safe_report(on_result, contact, *done.result())
+            )
+
+
+def _settle(contacts, futures, on_result=None, on_dead_letter=None):
+    """
+    Report each contact's final result as its (retrying) future resolves.
+    Returns a list of (success, msg) in input order once all have resolved.
+    """
+    _report_when_done(contacts, futures, on_result)
+
+    results = [future.result() for future in futures]
+    if on_dead_letter is not None:
+        for contact, future, (_, msg) in zip(contacts, futures, results):
+            if future.gave_up:
+                on_dead_letter(contact, msg)
+    return results
+
+
+def _report(contacts, results, on_result):
+    if on_result is not None:
+        for contact, (success, msg) in zip(contacts, results):
+            on_result(contact, success, msg)
+
+
+def _dispatch_batched(retrier, channel, contacts, content, on_result=None, on_dead_letter=None):
+    """
+    Same text for every contact on a channel with a bulk API: one send_batch call per
+    channel.batch_size recipients, each call's outcome mapped back onto its contacts.
+    A batch that fails transiently is retried as a whole.
+    Returns a list of (success, msg) in input order.
+    """
+    mode = channel.name
+    values = [contact.get(channel.field) for contact in contacts]
+    results = [None] * len(contacts)
+    targets = []
+    for idx, value in enumerate(values):
+        if value:
+            targets.append(idx)
+        else:
+            results[idx] = (False, f"❌ Contact info missing for mode '{mode}'.")
+            if on_result is not None:
+                _safe_report(on_result, contacts[idx], *results[idx])
+
+    async def send_batch(batch):
+        async with _channel_slot(mode):
+            with metrics.SENDS_IN_FLIGHT.track(channel=mode):
+                # Recipients were validated upstream, so the whole batch shares the request's outcome
+                return (await channel.send_batch_async(content, [values[idx] for idx in batch]))[0]
+
+    size = channel.batch_size
+    batches = [targets[start:start + size] for start in range(0, len(targets), size)]
+    batch_futures = [retrier.submit(mode, send_batch, batch) for batch in batches]
+    futures = [future for batch, future in zip(batches, batch_futures) for _ in batch]
+
+    sent = _settle([contacts[idx] for idx in targets], futures, on_result, on_dead_letter)
+    for idx, result in zip(targets, sent):
+        results[idx] = result
+    return results
+
+
+async def _process_safely(contact, *args, **kwargs):
+    try:
+        return await process_contact(contact, *args, **kwargs)
+    except Exception as e:
+        logging.error("Exception while dispatching to contact", exc_info=True)
+        return False, f"{type(e).__name__}: {e}"
+
+
+def _forward(done, future):
+    # Pass a send's final outcome (and whether it gave up) on to the future reported for it
+    future.gave_up = getattr(done, 'gave_up', False)
+    try:
+        future.set_result(done.result())
+    except Exception as e:
+        future.set_result((False, f"{type(e).__name__}: {e}"))
+
+
+def _generate_and_send(retrier, contacts, channel, use_custom, user_message, on_result=None, on_dead_letter=None):
+    """
+    Per-contact generation pipelined into sending: each contact is queued for sending as
+    soon as its text is generated, so a large chunk starts sending (and reporting
+    progress) after its first completion rather than its last.
+    Returns a list of (success, msg) in input order.
+    """
+    mode = channel.name
+    futures = [Future() for _ in contacts]
+    _report_when_done(contacts, futures, on_result)
+
+    def send(idx, generated):
+        try:
+            sent = retrier.submit(
+                mode, _process_safely, contacts[idx], channel, use_custom, user_message, generated=generated
+            )
+        except Exception as e:
+            futures[idx].gave_up = False
+            futures[idx].set_result((False, f"{type(e).__name__}: {e}"))
+            return
+        sent.add_done_callback(lambda done: _forward(done, futures[idx]))
+
+    generate_content_many([
+        {'mode': mode, 'user_need': user_message, 'recipient_name': contact.get('name', 'User')}
+        for contact in contacts
+    ], on_item=send)
+    return _settle(contacts, futures, on_dead_letter=on_dead_letter)
+
+
+def _dispatch_chunk(retrier, contacts, channel, use_custom, user_message, on_result=None, on_dead_letter=None,
+                    template=None, generated=None):
+    """
+    Send one chunk of contacts. Returns a list of (success, msg) in input order.
+    generated, if given, is each contact's (success, text) already generated for it (or None).
+    """
+    mode = channel.name
+    # Identical text for everyone: use the channel's batch API instead of one call per contact
+    if use_custom == 'yes' and user_message and channel.batch_size:
+        return _dispatch_batched(retrier, channel, contacts, user_message, on_result, on_dead_letter)
+
+    # Per-contact generation is rate limited; each text is sent as soon as it is ready
+    if generated is None and use_custom == 'no' and template is None:
+        return _generate_and_send(retrier, contacts, channel, use_custom, user_message, on_result, on_dead_letter)
+    if generated is None:
+        generated = [None] * len(contacts)
+
+    futures = [
+        retrier.submit(
+            mode, _process_safely, contact, channel, use_custom, user_message,
+            template=template, generated=contact_generated
+        )
+        for contact, contact_generated in zip(contacts, generated)
+    ]
+    return _settle(contacts, futures, on_result, on_dead_letter)
+
+
+def _recording(ledger, on_result):
+    """
+    Wrap on_result so every successful send is written to the delivery ledger first.
+    """
+    def record(contact, success, msg):
+        if success:
+            try:
+                ledger.record(contact, msg)
+            except Exception:
+                logging.error("Could not record delivery in the ledger", exc_info=True)
+        if on_result is not None:
+            on_result(contact, success, msg)
+    return record
+
+
+def dispatch_stream(chunks, mode, use_custom, user_message, email_subject=None, attachments=None,
+                    max_workers=None, on_result=None, on_chunk=None, campaign_id=None, on_dead_letter=None,
+                    on_unsent=None):
+    """
+    Dispatch contacts as they arrive, one chunk (list of contacts) at a time,
+    so sending starts before a large sheet has been fully parsed.
+    The channel (SMTP pool, encoded attachments, clients) and the LLM template are
+    prepared once for the whole stream.
+    on_chunk(contacts) is called as each chunk is received.
+    With a campaign_id, deliveries go to the ledger and recipients it already has are
+    skipped, so re-running an interrupted campaign only sends to the rest.
+    Transient provider failures are retried with backoff; on_dead_letter(contact, msg) is
+    called for each one still failing after the last attempt (it is also in failures).
+    on_unsent(mode, count) is called with how many of each chunk's contacts were never
+    handed to the channel (invalid, or already delivered).
+    Returns a tuple: (successes, failures), each a list of (contact, msg) in input order.
+    """
+    channel = get_channel(mode)
+    if channel is None:
+        raise ValueError(f"Unsupported communication mode: {mode}")
+    max_workers = max_workers or DISPATCH_WORKERS
+
+    template = None
+    if use_custom == 'no' and LLM_TEMPLATE_MODE:
+        template = generate_template(mode, user_message)
+        if template is None:
+            logging.warning("Template generation failed, falling back to per-contact generation")
+
+    # Pools are sized to the channel's in-flight limit
+    channel = channel.prepare(subject=email_subject, attachments=attachments, concurrency=CHANNEL_LIMITS.get(mode))
+
+    validator = ContactValidator(mode, field=channel.field)
+    ledger = DeliveryLedger(campaign_id, mode) if campaign_id else None
+    if ledger is not None:
+        on_result = _recording(ledger, on_result)
+    successes = []
+    failures = []
+
+    try:
+        with LoopExecutor(max_workers, name='dispatch') as executor, RetryScheduler(executor) as retrier:
+            for contacts in chunks:
+                if on_chunk is not None:
+                    on_chunk(contacts)
+
+                # Bad and duplicate rows fail here, before any LLM or provider call is paid for
+                with metrics.timer('validation', mode):
+                    contacts, invalid = validator.validate(contacts)
+                metrics.CONTACTS_REJECTED.inc(len(invalid), channel=mode)
+                for contact, msg in invalid:
+                    _report([contact], [(False, msg)], on_result)
+                failures.extend(invalid)
+                unsent = len(invalid)
+
+                if ledger is not None:
+                    contacts, delivered = ledger.partition(contacts)
+                    skipped = [(True, "⏭️ Already delivered in an earlier run")] * len(delivered)
+                    _report(delivered, skipped, on_result)
+                    _split_results(delivered, skipped, successes, failures)
+                    unsent += len(delivered)
+
+                if on_unsent is not None and unsent:
+                    on_unsent(mode, unsent)
+
+                results = _dispatch_chunk(
+                    retrier, contacts, channel, use_custom, user_message,
+                    on_result=on_result, on_dead_letter=on_dead_letter, template=template
+                )
+                _split_results(contacts, results, successes, failures)
+
+                sent = sum(success for success, _ in results)
+                metrics.SENDS.inc(sent, channel=mode, outcome='success')
+                metrics.SENDS.inc(len(results) - sent, channel=mode, outcome='failure')
+    finally:
+        channel.close()
+        if ledger is not None:
+            ledger.close()
+
+    logging.info(f"Campaign ({mode}) finished: {len(successes)} sent, {len(failures)} failed")
+    return successes, failures
+
+
+def _fallback_chains(modes, fallbacks):
+    """
+    Check a multi-channel campaign's channels and fallback rules ({mode: fallback mode}).
+    Returns a list of chains, one per mode in order: [mode, its fallback, the fallback's fallback, ...].
+    Raises ValueError for an unknown channel, a channel used twice, or a rule for a
+    channel the campaign never sends on.
+    """
+    if not modes:
+        raise ValueError("No communication mode given")
+    for mode in list(modes) + list(fallbacks.values()):
+        if get_channel(mode) is None:
+            raise ValueError(f"Unsupported communication mode: {mode}")
+
+    used = set()
+    chains = []
+    for mode in modes:
+        chain = [mode]
+        while chain[-1] in fallbacks:
+            chain.append(fallbacks[chain[-1]])
+            # Also stops a cycle of fallbacks
+            if chain[-1] in chain[:-1] or chain[-1] in modes:
+                raise ValueError(f"Channel '{chain[-1]}' is used more than once in the campaign")
+        if used & set(chain):
+            raise ValueError(f"Channel '{(used & set(chain)).pop()}' is used more than once in the campaign")
+        used.update(chain)
+        chains.append(chain)
+
+    unused = set(fallbacks) - used
+    if unused:
+        raise ValueError(f"Fallback given for a channel the campaign does not send on: {', '.join(sorted(unused))}")
+    return chains
+
+
+def _validate_aligned(validator, contacts):
+    """
+    validator.validate(contacts), lined up with the input.
+    Returns a list with each contact's (normalized contact, None) or (None, rejection reason).
+    """
+    passed, rejected = validator.validate(contacts)
+    reasons = {id(contact): msg for contact, msg in rejected}
+    passed = iter(passed)
+    return [
+        (None, reasons[id(contact)]) if id(contact) in reasons else (next(passed), None)
+        for contact in contacts
+    ]
+
+
+def _trail_message(trail):
+    return '; '.join(f"{mode}: {msg}" for mode, msg in trail)
+
+
+class _Lane:
+    """
+    One channel of a multi-channel campaign, run on its own thread with its own prepared
+    channel, send executor, retry scheduler and ledger. Chunks arrive on a bounded queue as
+    lists of (contact, checks, trail): checks maps each contact field to the shared
+    validation result, trail holds the (mode, msg) of channels already tried.
+    Contacts that fail here are passed on to the fallback lane, if there is one.
+    """
+
+    def __init__(self, mode, use_custom, user_message, settle, email_subject=None, attachments=None,
+                 max_workers=None, campaign_id=None, on_dead_letter=None, on_unsent=None):
+        self.mode = mode
+        self.use_custom = use_custom
+        self.user_message = user_message
+        self.settle = settle
+        self.on_dead_letter = on_dead_letter
+        self.on_unsent = on_unsent
+        self.fallback = None
+        self.error = None
+        self.queue = queue.Queue(maxsize=LANE_BACKLOG)
+
+        self.template = None
+        if use_custom == 'no' and LLM_TEMPLATE_MODE:
+            self.template = generate_template(mode, user_message)
+            if self.template is None:
+                logging.warning(f"Template generation failed for {mode}, falling back to per-contact generation")
+
+        self.channel = get_channel(mode).prepare(
+            subject=email_subject, attachments=attachments, concurrency=CHANNEL_LIMITS.get(mode)
+        )
+        self.field = self.channel.field
+        self.ledger = DeliveryLedger(campaign_id, mode) if campaign_id else None
+        self._executor = LoopExecutor(max_workers, name=f'dispatch-{mode}')
+        self._retrier = RetryScheduler(self._executor)
+        self._thread = threading.Thread(target=self._run, name=f'lane-{mode}', daemon=True)
+        self._thread.start()
+
+    def chain(self):
+        lane = self
+        while lane is not None:
+            yield lane
+            lane = lane.fallback
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            # After an error the lane keeps draining its queue (so nothing upstream blocks) but sends nothing
+            if self.error is not None:
+                self._report_unsent(len(task[0]))
+                continue
+            try:
+                self._dispatch(*task)
+            except Exception as e:
+                logging.error(f"Exception in {self.mode} lane", exc_info=True)
+                self.error = e
+        if self.fallback is not None:
+            self.fallback.queue.put(None)
+
+    def _report_unsent(self, count):
+        if self.on_unsent is not None and count:
+            self.on_unsent(self.mode, count)
+
+    def _delivered_on(self, checks):
+        # A resumed campaign skips anyone this channel, or one it falls back to, already reached
+        for lane in self.chain():
+            contact = checks[lane.field][0]
+            if lane.ledger is not None and contact is not None and lane.ledger.is_delivered(contact):
+                return lane.mode
+        return None
+
+    def _dispatch(self, items, generated):
+        mode = self.mode
+        pending = []
+        failed = []
+        for contact, checks, trail in items:
+            valid, error = checks[self.field]
+            if error:
+                metrics.CONTACTS_REJECTED.inc(channel=mode)
+                failed.append((contact, checks, trail + [(mode, error)]))
+                continue
+            delivered_on = self._delivered_on(checks)
+            if delivered_on is not None:
+                self.settle(valid, True, trail + [(delivered_on, "⏭️ Already delivered in an earlier run")])
+                continue
+            pending.append((valid, checks, trail))
+        self._report_unsent(len(items) - len(pending))
+
+        contacts = [contact for contact, _, _ in pending]
+        trails = {id(contact): trail for contact, _, trail in pending}
+
+        def on_result(contact, success, msg):
+            if success and self.ledger is not None:
+                try:
+                    self.ledger.record(contact, msg)
+                except Exception:
+                    logging.error("Could not record delivery in the ledger", exc_info=True)
+            # Failures are settled once the chunk is done: here, or by the fallback lane
+            if success:
+                self.settle(contact, True, trails[id(contact)] + [(mode, msg)])
+
+        on_dead_letter = None
+        if self.on_dead_letter is not None and self.fallback is None:
+            on_dead_letter = lambda contact, msg: self.on_dead_letter(contact, msg, mode)
+
+        contact_generated = None
+        if self.use_custom == 'no' and self.template is None and generated is not None:
+            contact_generated = [generated.get(contact.get('name', 'User')) for contact in contacts]
+        results = _dispatch_chunk(
+            self._retrier, contacts, self.channel, self.use_custom, self.user_message,
+            on_result=on_result, on_dead_letter=on_dead_letter,
+            template=self.template, generated=contact_generated
+        )
+        sent = sum(success for success, _ in results)
+        metrics.SENDS.inc(sent, channel=mode, outcome='success')
+        metrics.SENDS.inc(len(results) - sent, channel=mode, outcome='failure')
+
+        failed.extend(
+            (contact, checks, trail + [(mode, msg)])
+            for (contact, checks, trail), (success, msg) in zip(pending, results)
+            if not success
+        )
+        if not failed:
+            return
+        if self.fallback is not None:
+            self.fallback.queue.put((failed, generated))
+        else:
+            for contact, _, trail in failed:
+                self.settle(contact, False, trail)
+
+    def join(self):
+        self._thread.join()
+        self._retrier.close()
+        self._executor.shutdown()
+        self.channel.close()
+        if self.ledger is not None:
+            self.ledger.close()
+
+
+def dispatch_multi(chunks, modes, use_custom, user_message, fallbacks=None, email_subject=None, attachments=None,
+                   max_workers=None, on_result=None, on_chunk=None, campaign_id=None, on_dead_letter=None,
+                   on_unsent=None):
+    """
+    Dispatch one stream of contacts on several channels in a single pass.
+    Each mode in modes runs on its own lane (thread, pool, retries, ledger) concurrently
+    with the others; fallbacks ({mode: fallback mode}, e.g. {'whatsapp': 'sms'}) sends a
+    contact that fails on a channel, or is not valid for it, on through the fallback.
+    Every chunk is validated once per contact field and, when a message has to be
+    generated per contact, generated once per recipient for all channels; each channel
+    still gets its own LLM template.
+    on_chunk(contacts) is called once per mode as each chunk is received, and
+    on_result(contact, success, msg) once per contact and mode, msg naming each channel tried.
+    on_dead_letter(contact, msg, mode) is called for transient failures on the last channel
+    of a fallback chain, mode being that channel.
+    on_unsent(mode, count) is called with how many contacts of a chunk each channel (fallbacks
+    included) did not send to: invalid for it, already delivered, or left after a lane error.
+    Returns a tuple: (successes, failures), each a list of (contact, msg) in completion order.
+    Raises ValueError for unknown channels or inconsistent fallback rules.
+    """
+    fallbacks = fallbacks or {}
+    chains = _fallback_chains(modes, fallbacks)
+    max_workers = max_workers or DISPATCH_WORKERS
+
+    successes = []
+    failures = []
+    lock = threading.Lock()
+
+    def settle(contact, success, trail):
+        msg = _trail_message(trail)
+        with lock:
+            (successes if success else failures).append((contact, msg))
+        if on_result is not None:
+            _safe_report(on_result, contact, success, msg)
+
+    lanes = []
+    primaries = []
+    try:
+        for chain in chains:
+            upstream = None
+            for mode in chain:
+                lane = _Lane(
+                    mode, use_custom, user_message, settle, email_subject=email_subject, attachments=attachments,
+                    max_workers=max_workers, campaign_id=campaign_id, on_dead_letter=on_dead_letter,
+                    on_unsent=on_unsent
+                )
+                lanes.append(lane)
+                if upstream is None:
+                    primaries.append(lane)
+                else:
+                    upstream.fallback = lane
+                upstream = lane
+
+        # One validator per contact field, shared by every channel sending to it
+        fields = {}
+        for lane in lanes:
+            fields.setdefault(lane.field, []).append(lane.mode)
+        validators = {field: ContactValidator('/'.join(field_modes), field=field) for field, field_modes in fields.items()}
+        shared_generation = use_custom == 'no' and any(lane.template is None for lane in lanes)
+
+        for contacts in chunks:
+            if on_chunk is not None:
+                for _ in primaries:
+                    on_chunk(contacts)
+
+            checked = {}
+            for field, validator in validators.items():
+                with metrics.timer('validation', validator.mode):
+                    checked[field] = _validate_aligned(validator, contacts)
+            checks = [{field: results[idx] for field, results in checked.items()} for idx in range(len(contacts))]
+
+            items = [(contact, contact_checks, []) for contact, contact_checks in zip(contacts, checks)]
+            if not shared_generation:
+                for lane in primaries:
+                    lane.queue.put((items, None))
+                continue
+
+            for start in range(0, len(items), GENERATION_SLICE):
+                batch = items[start:start + GENERATION_SLICE]
+                # Once per distinct recipient name, only for contacts some channel can reach
+                names = list(dict.fromkeys(
+                    contact.get('name', 'User')
+                    for contact, contact_checks, _ in batch
+                    if any(error is None for _, error in contact_checks.values())
+                ))
+                generated = dict(zip(names, generate_content_many([
+                    {'mode': modes[0], 'user_need': user_message, 'recipient_name': name} for name in names
+                ])))
+                for lane in primaries:
+                    lane.queue.put((batch, generated))
+    finally:
+        for lane in primaries:
+            lane.queue.put(None)
+        for lane in lanes:
+            lane.join()
+
+    for lane in lanes:
+        if lane.error is not None:
+            raise lane.error
+
+    logging.info(f"Campaign ({', '.join(modes)}) finished: {len(successes)} sent, {len(failures)} failed")
+    return successes, failures
+
+
+def _split_results(contacts, results, successes, failures):
+    for contact, (success, msg) in zip(contacts, results):
+        if success:
+            successes.append((contact, msg))
+        else:
+            failures.append((contact, msg))
@@ -0,0 +1,125 @@
+"""
+The process-wide asyncio event loop that provider calls run on.
+
+The senders in async_senders.py are coroutines; they all run on one loop in a daemon
+thread, so thousands of sends can wait on providers at once without an OS thread each.
+Sync code hands work to the loop with run() (block for one result) or LoopExecutor
+(a Future per send, for the dispatcher's RetryScheduler).
+"""
+import os
+import asyncio
+import threading
+import concurrent.futures
+from concurrent.futures import Future, CancelledError, ThreadPoolExecutor
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # The loop's thread does not survive fork(); a worker process starts its own loop
+    global _loop, _loop_lock
+    _loop = None
+    _loop_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_loop():
+    """
+    Returns the shared event loop, starting its thread on first use.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='event-loop', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def _on_loop(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def run(coro, timeout=None):
+    """
+    Run a coroutine on the shared loop and block until it finishes. Returns its result.
+    Raises RuntimeError when called from a coroutine on that loop, which would wait on itself.
+    """
+    loop = get_loop()
+    if _on_loop(loop):
+        coro.close()
+        raise RuntimeError("Blocking call made from the event loop thread; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+class LoopExecutor:
+    """
+    Executor-like front for the shared loop: submit(fn, *args, **kwargs) schedules the
+    coroutine fn(*args, **kwargs) and returns a concurrent.futures.Future for its result.
+
+    - At most `max_in_flight` of its coroutines run at once; the rest wait on the loop.
+    - Futures are resolved, and their done callbacks run, on one bookkeeping thread, so
+      result handling (retries, ledger writes, progress) never blocks the loop.
+    """
+
+    def __init__(self, max_in_flight, name='dispatch'):
+        self.loop = get_loop()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._results = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name}-results')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    async def _bounded(self, fn, args, kwargs):
+        async with self._slots:
+            return await fn(*args, **kwargs)
+
+    @staticmethod
+    def _resolve(done, future):
+        if done.cancelled():
+            future.set_exception(CancelledError())
+        elif done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(done.result())
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) on the loop. Returns a Future for its result.
+        Raises RuntimeError after shutdown(), like ThreadPoolExecutor.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._pending.add(future)
+        future.add_done_callback(self._finished)
+
+        running = asyncio.run_coroutine_threadsafe(self._bounded(fn, args, kwargs), self.loop)
+        running.add_done_callback(lambda done: self._results.submit(self._resolve, done, future))
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending)
+        if wait:
+            concurrent.futures.wait(pending)
+        self._results.shutdown(wait=wait)
@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+from dotenv import load_dotenv
+from werkzeug.utils import secure_filename
+
+load_dotenv()
+
+JOBS_DB = os.getenv('JOBS_DB', 'jobs.db')
+JOBS_SPOOL_DIR = os.getenv('JOBS_SPOOL_DIR', 'job_files')
+# A running job whose worker has not reported progress for this many seconds is
+# presumed dead (killed, redeployed) and handed to the next worker to resume
+JOB_STALE_AFTER = float(os.getenv('JOB_STALE_AFTER', '300'))
+# Days a finished or failed job can still be resumed or have its dead letters retried;
+# after that its spooled files are deleted
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', '7'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    unchanged INTEGER NOT NULL DEFAULT 0,
+    successes TEXT,
+    failures TEXT,
+    dead_letters TEXT,
+    error TEXT,
+    worker TEXT,
+    run_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+# Columns added after the first release: (name, type) for ALTER TABLE on older databases
+_ADDED_COLUMNS = [
+    ('updated_at', 'REAL'), ('dead_letters', 'TEXT'), ('unchanged', 'INTEGER NOT NULL DEFAULT 0'), ('run_at', 'REAL'),
+    ('purged_at', 'REAL')
+]
+
+# Job lifecycle
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def connect(db_path=None):
+    """
+    Open the job database in autocommit mode.
+    Connections may be handed between threads; callers serialize their use.
+    """
+    conn = sqlite3.connect(db_path or JOBS_DB, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for name, column_type in _ADDED_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+    return conn
+
+
+def _job_dir(job_id):
+    return os.path.join(JOBS_SPOOL_DIR, job_id)
+
+
+def _save_upload(job_id, file_storage):
+    """
+    Copy an uploaded FileStorage object into the job's spool directory so a worker
+    process can read it after the request has finished.
+    Returns a (filename, path) pair.
+    """
+    job_dir = _job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, secure_filename(file_storage.filename) or uuid.uuid4().hex)
+    file_storage.save(path)
+    return file_storage.filename, path
+
+
+def _save_attachments(job_id, attachments):
+    return [
+        _save_upload(job_id, file_storage)
+        for file_storage in attachments or []
+        if file_storage and file_storage.filename
+    ]
+
+
+def _copy_attachments(job_id, attachments):
+    """
+    Copy another job's spooled attachments into this job's spool directory, so they
+    outlive the other job's retention.
+    """
+    if not attachments:
+        return []
+    job_dir = _job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    return [(filename, shutil.copy(path, job_dir)) for filename, path in attachments]
+
+
+def load_attachments(payload):
+    """
+    Returns a job's spooled attachments as (filename, path) pairs,
+    which prepare_attachments encodes straight from disk.
+    """
+    return [(filename, path) for filename, path in payload.get('attachments', [])]
+
+
+def enqueue_job(mode, use_custom, user_message, email_subject=None, attachments=None, contacts=None, sheet=None,
+                contact_list=None, contact_filter=None, save_list_as=None, list_base=None, delta_baseline=None,
+                modes=None, fallbacks=None, run_at=None, spread_seconds=None):
+    """
+    Persist a campaign for the worker processes.
+    Recipients are a list of contact dicts, a sheet stored by uploads.spool_sheet (which
+    the worker parses in chunks while it sends; total grows as chunks are read), or the
+    name of a saved contact list, narrowed by contact_filter (see contact_store).
+    save_list_as saves the sheet's contacts as a named list while the campaign runs, unless
+    the list has changed from list_base (its version id when queued) in the meantime;
+    with delta_baseline (a ContactStore.snapshot of that version) only contacts added or
+    changed since that version are sent.
+    modes (all channels, mode first) and fallbacks ({mode: fallback mode}) make it a
+    multi-channel campaign (see dispatcher.dispatch_multi).
+    run_at (epoch seconds) holds the campaign until then; spread_seconds paces its sends
+    evenly over that window (see scheduler).
+    Returns the new job ID.
+    """
+    job_id = uuid.uuid4().hex
+    payload = {
+        'contacts': contacts,
+        'sheet': [sheet.filename, sheet.path] if sheet is not None else None,
+        'sheet_digest': sheet.digest if sheet is not None else None,
+        'contact_list': contact_list,
+        'contact_filter': contact_filter,
+        'save_list_as': save_list_as,
+        'list_base': list_base,
+        'delta_baseline': delta_baseline,
+        'modes': modes,
+        'fallbacks': fallbacks,
+        'spread_seconds': spread_seconds,
+        'use_custom': use_custom,
+        'user_message': user_message,
+        'email_subject': email_subject,
+        'attachments': _save_attachments(job_id, attachments),
+    }
+    _insert_job(job_id, ','.join(modes) if modes else mode, payload, len(contacts) if contacts else 0, run_at=run_at)
+    return job_id
+
+
+def _insert_job(job_id, mode, payload, total, run_at=None):
+    conn = connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, status, mode, payload, total, run_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, mode, json.dumps(payload), total, run_at, time.time())
+        )
+    finally:
+        conn.close()
+
+    logging.info(f"Enqueued job {job_id} ({mode})")
+
+
+def claim_next_job(conn, worker_id):
+    """
+    Atomically move the oldest queued job that is due (or a running job whose worker went
+    quiet) to running.
+    Returns the job row, or None if the queue is empty.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id, status FROM jobs WHERE (status = ? AND COALESCE(run_at, 0) <= ?) "
+            "OR (status = ? AND COALESCE(updated_at, started_at) < ?) ORDER BY created_at LIMIT 1",
+            (QUEUED, now, RUNNING, now - JOB_STALE_AFTER)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        if row['status'] == RUNNING:
+            logging.warning(f"Job {row['id']} went stale, resuming it on {worker_id}")
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = ?, started_at = ?, updated_at = ? WHERE id = ?",
+            (RUNNING, worker_id, now, now, row['id'])
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+
+
+def update_progress(conn, job_id, sent, failed, total):
+    conn.execute(
+        "UPDATE jobs SET sent = ?, failed = ?, total = ?, updated_at = ? WHERE id = ?",
+        (sent, failed, total, time.time(), job_id)
+    )
+
+
+def defer_job(conn, job_id, run_at):
+    """
+    Hand a running job back to the queue until run_at (a paced campaign's next release).
+    """
+    conn.execute(
+        "UPDATE jobs SET status = ?, run_at = ?, worker = NULL, updated_at = ? WHERE id = ?",
+        (QUEUED, run_at, time.time(), job_id)
+    )
+
+
+def resume_job(job_id):
+    """
+    Queue a finished or failed job to run again. Recipients already in the
+    delivery ledger are skipped, so only the undelivered ones are re-sent.
+    Jobs past JOB_RETENTION_DAYS have lost their files and cannot be resumed.
+    Returns True if the job was requeued.
+    """
+    conn = connect()
+    try:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, sent = 0, failed = 0, error = NULL, successes = NULL, failures = NULL, "
+            "dead_letters = NULL, worker = NULL, started_at = NULL, updated_at = NULL, finished_at = NULL "
+            "WHERE id = ? AND status IN (?, ?) AND purged_at IS NULL",
+            (QUEUED, job_id, DONE, FAILED)
+        )
+    finally:
+        conn.close()
+    return cursor.rowcount > 0
+
+
+def _results_to_json(results):
+    return json.dumps([{'contact': contact, 'msg': msg} for contact, msg in results])
+
+
+def _dead_letters_to_json(dead_letters):
+    return json.dumps([
+        {'contact': contact, 'msg': msg, 'channel': channel} for contact, msg, channel in dead_letters
+    ])
+
+
+def finish_job(conn, job_id, successes, failures, dead_letters=None, unchanged=0):
+    """
+    dead_letters are (contact, msg, channel) for each send that gave up on a channel.
+    """
+    conn.execute(
+        "UPDATE jobs SET status = ?, sent = ?, failed = ?, total = ?, successes = ?, failures = ?, dead_letters = ?, "
+        "unchanged = ?, finished_at = ? WHERE id = ?",
+        (DONE, len(successes), len(failures), len(successes) + len(failures),
+         _results_to_json(successes), _results_to_json(failures), _dead_letters_to_json(dead_letters or []),
+         unchanged, time.time(), job_id)
+    )
+
+
+def retry_dead_letters(job_id):
+    """
+    Queue new jobs that re-send only the given job's dead letters (transient failures
+    that outlasted every retry), with the original message settings and attachments.
+    Each contact is retried only on the channel it was dead-lettered on: one job per channel.
+    Returns the new job IDs (empty if there is nothing to retry).
+    """
+    conn = connect()
+    try:
+        row = conn.execute(
+            "SELECT mode, payload, dead_letters FROM jobs WHERE id = ? AND purged_at IS NULL", (job_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return []
+
+    by_channel = {}
+    for item in json.loads(row['dead_letters'] or '[]'):
+        # Dead letters recorded before channels were kept come from single-channel campaigns
+        by_channel.setdefault(item.get('channel') or row['mode'], []).append(item['contact'])
+
+    new_job_ids = []
+    for channel, contacts in by_channel.items():
+        payload = json.loads(row['payload'])
+        new_job_id = uuid.uuid4().hex
+        payload.update(
+            contacts=contacts, sheet=None, sheet_digest=None, contact_list=None, save_list_as=None, list_base=None,
+            delta_baseline=None, modes=None, fallbacks=None, spread_seconds=None,
+            attachments=_copy_attachments(new_job_id, payload.get('attachments'))
+        )
+        _insert_job(new_job_id, channel, payload, len(contacts))
+        new_job_ids.append(new_job_id)
+    return new_job_ids
+
+
+def fail_job(conn, job_id, error):
+    conn.execute(
+        "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+        (FAILED, error, time.time(), job_id)
+    )
+
+
+def sheets_in_use(conn):
+    """
+    Returns the digests of the spooled sheets that jobs may still read (see uploads.purge_spool).
+    """
+    return {
+        row[0] for row in conn.execute(
+            "SELECT json_extract(payload, '$.sheet_digest') FROM jobs WHERE purged_at IS NULL"
+        )
+        if row[0]
+    }
+
+
+def purge_jobs(conn, retention_days=None):
+    """
+    Retire finished and failed jobs older than retention_days (JOB_RETENTION_DAYS by
+    default): they can no longer be resumed, and their spooled attachments are deleted.
+    Their results stay viewable.
+    Returns the retired jobs' payloads as (job_id, payload) pairs.
+    """
+    retention_days = JOB_RETENTION_DAYS if retention_days is None else retention_days
+    now = time.time()
+    cutoff = now - retention_days * 86400
+    rows = conn.execute(
+        "SELECT id, payload FROM jobs WHERE status IN (?, ?) AND finished_at < ? AND purged_at IS NULL",
+        (DONE, FAILED, cutoff)
+    ).fetchall()
+
+    purged = []
+    for row in rows:
+        # Unless it was resumed (or retired by another worker) in the meantime
+        cursor = conn.execute(
+            "UPDATE jobs SET purged_at = ? WHERE id = ? AND status IN (?, ?) AND finished_at < ? AND purged_at IS NULL",
+            (now, row['id'], DONE, FAILED, cutoff)
+        )
+        if cursor.rowcount:
+            shutil.rmtree(_job_dir(row['id']), ignore_errors=True)
+            purged.append((row['id'], json.loads(row['payload'])))
+    if purged:
+        logging.info(f"Retired {len(purged)} job(s) older than {retention_days:g} day(s)")
+    return purged
+
+
+def get_job(job_id):
+    """
+    Returns the job as a dict (results decoded to (contact, msg) pairs), or None.
+    """
+    conn = connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+
+    job = {key: row[key] for key in row.keys() if key != 'payload'}
+    for key in ('successes', 'failures', 'dead_letters'):
+        job[key] = [(item['contact'], item['msg']) for item in json.loads(row[key] or '[]')]
+    return job
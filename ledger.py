@@ -0,0 +1,90 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from dotenv import load_dotenv
+
+from channels import contact_field
+
+load_dotenv()
+
+LEDGER_DB = os.getenv('LEDGER_DB', 'ledger.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    campaign_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    contact_key TEXT NOT NULL,
+    message TEXT,
+    delivered_at REAL NOT NULL,
+    PRIMARY KEY (campaign_id, channel, contact_key)
+) WITHOUT ROWID;
+"""
+
+
+def contact_key(contact, channel):
+    """
+    The recipient as the channel sees it: the normalized phone or email
+    (contacts reaching the dispatcher have been through validation).
+    """
+    return contact.get(contact_field(channel)) or ''
+
+
+class DeliveryLedger:
+    """
+    Per-recipient record of successful sends for one campaign and channel.
+
+    Everything already delivered is loaded into memory when the ledger opens, so a
+    resumed campaign checks each recipient with a set lookup; each new delivery is
+    written through to SQLite as soon as its send returns.
+    Delivery is at-least-once: a crash between a send and its write re-sends that one recipient.
+    """
+
+    def __init__(self, campaign_id, channel, db_path=None):
+        self.campaign_id = campaign_id
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path or LEDGER_DB, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: a commit survives a process crash without an fsync per delivery
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        rows = self._conn.execute(
+            "SELECT contact_key FROM deliveries WHERE campaign_id = ? AND channel = ?", (campaign_id, channel)
+        )
+        self._delivered = {key for (key,) in rows}
+        if self._delivered:
+            logging.info(f"Resuming campaign {campaign_id} ({channel}): {len(self._delivered)} already delivered")
+
+    def __len__(self):
+        return len(self._delivered)
+
+    def is_delivered(self, contact):
+        return contact_key(contact, self.channel) in self._delivered
+
+    def partition(self, contacts):
+        """
+        Returns a tuple: (contacts still to send, contacts already delivered)
+        """
+        pending = []
+        delivered = []
+        for contact in contacts:
+            (delivered if self.is_delivered(contact) else pending).append(contact)
+        return pending, delivered
+
+    def record(self, contact, message=None):
+        key = contact_key(contact, self.channel)
+        with self._lock:
+            if key in self._delivered:
+                return
+            self._conn.execute(
+                "INSERT OR IGNORE INTO deliveries (campaign_id, channel, contact_key, message, delivered_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.campaign_id, self.channel, key, message, time.time())
+            )
+            self._delivered.add(key)
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '3600'))
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '512'))
+# Optional on-disk tier shared by every worker process; empty disables it
+LLM_CACHE_DB = os.getenv('LLM_CACHE_DB', '')
+LLM_CACHE_DISK_SIZE = int(os.getenv('LLM_CACHE_DISK_SIZE', '10000'))
+
+DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at);
+"""
+
+# Disk evictions are batched: prune once every this many writes
+_PRUNE_EVERY = 50
+
+
+def cache_key(payload):
+    """
+    Content hash of a chat completion request: model, temperature and the
+    messages with whitespace collapsed, so cosmetic prompt differences share an entry.
+    """
+    normalized = {
+        'model': payload.get('model'),
+        'temperature': payload.get('temperature'),
+        'messages': [
+            {'role': message['role'], 'content': ' '.join(message['content'].split())}
+            for message in payload.get('messages', [])
+        ],
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache for completion texts.
+
+    - Memory tier: per-process LRU of at most `size` entries.
+    - Disk tier (optional): SQLite file shared across processes, LRU-pruned to `disk_size` entries.
+    Entries older than `ttl` seconds are treated as misses in both tiers.
+    """
+
+    def __init__(self, size=None, ttl=None, db_path=None, disk_size=None):
+        self.size = size or LLM_CACHE_SIZE
+        self.ttl = LLM_CACHE_TTL if ttl is None else ttl
+        self.db_path = LLM_CACHE_DB if db_path is None else db_path
+        self.disk_size = disk_size or LLM_CACHE_DISK_SIZE
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(DISK_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, value, created_at):
+        with self._lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+        if self.db_path:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self._remember(key, row[0], row[1])
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        self._remember(key, value, now)
+
+        if self.db_path:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % _PRUNE_EVERY == 0
+            if prune:
+                self._prune(conn, now)
+
+    def _prune(self, conn, now):
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN "
+            "(SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_size,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.db_path:
+            self._db().execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._memory),
+            }
+
+
+cache = LLMCache()
@@ -0,0 +1,315 @@
+"""
+Lightweight in-process metrics, exposed in the Prometheus text format by /metrics.
+
+Counters, gauges and histograms are plain dicts keyed by label values, one lock per
+metric, so recording from a hot path costs a dict update. Every process (Gunicorn
+workers, campaign workers) writes its values to its own snapshot file in METRICS_DIR
+every METRICS_FLUSH_INTERVAL seconds; render() merges all snapshots:
+- counters and histograms are summed, including processes that have exited;
+- gauges are summed over processes that are still running.
+Clear METRICS_DIR when deploying, as with any Prometheus multiprocess setup.
+"""
+import os
+import json
+import time
+import bisect
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Where each process writes its snapshot; empty keeps metrics to the process serving /metrics
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# Seconds; spans an SMTP handshake (ms) up to a slow LLM completion (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = {}
+_dirty = False
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        global _dirty
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _dirty = True
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        global _dirty
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _dirty = True
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        global _dirty
+        with self._lock:
+            self._values[self._key(labels)] = value
+        _dirty = True
+
+    @contextmanager
+    def track(self, **labels):
+        """
+        Count the block as in progress while it runs.
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """
+    Values are [count per bucket (last is +Inf), sum, count]; buckets are
+    stored non-cumulative and accumulated when rendered.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        global _dirty
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+        _dirty = True
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+
+STAGE_SECONDS = Histogram(
+    'campaign_stage_seconds', "Time spent per pipeline stage (parse, llm, validation, provider, smtp_connect)",
+    ['stage', 'channel']
+)
+SENDS = Counter('sends_total', "Final outcome of each send, after retries", ['channel', 'outcome'])
+SEND_RETRIES = Counter('send_retries_total', "Sends retried after a transient provider failure", ['channel'])
+DEAD_LETTERS = Counter('send_dead_letters_total', "Sends still failing transiently after the last attempt", ['channel'])
+SENDS_IN_FLIGHT = Gauge('sends_in_flight', "Provider calls in progress", ['channel'])
+CONTACTS_REJECTED = Counter('contacts_rejected_total', "Contacts failing validation before any send", ['channel'])
+LLM_CACHE_REQUESTS = Counter('llm_cache_requests_total', "LLM cache lookups by result (hit or miss)", ['result'])
+CAMPAIGNS_RUNNING = Gauge('campaigns_running', "Campaigns being dispatched")
+
+
+def timer(stage, channel=''):
+    """
+    Time a block as one observation of a pipeline stage.
+    """
+    return STAGE_SECONDS.time(stage=stage, channel=channel)
+
+
+def timed(iterable, stage, channel=''):
+    """
+    Iterate, timing how long each item takes to produce (e.g. each chunk of a parsed sheet).
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, channel=channel)
+        yield item
+
+
+def _snapshot_path(pid=None):
+    return os.path.join(METRICS_DIR, f"metrics-{pid or os.getpid()}.json")
+
+
+def flush():
+    """
+    Write this process's values to its snapshot file (atomically) if anything changed.
+    """
+    global _dirty
+    if not METRICS_DIR or not _dirty:
+        return
+    _dirty = False
+    snapshot = {name: metric.snapshot() for name, metric in _registry.items()}
+    path = _snapshot_path()
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError:
+        logging.error("Could not write metrics snapshot", exc_info=True)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _start_flusher():
+    if METRICS_DIR:
+        threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+
+
+def _after_fork():
+    # A forked child starts from zero; the parent keeps reporting its own values
+    global _dirty
+    for metric in _registry.values():
+        # Fresh lock: another thread may have held the parent's at fork time
+        metric._lock = threading.Lock()
+        metric.reset()
+    _dirty = False
+    _start_flusher()
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshots():
+    """
+    Yields (snapshot, running) for every process's snapshot, this process's from memory.
+    """
+    yield {name: metric.snapshot() for name, metric in _registry.items()}, True
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.startswith('metrics-') or not filename.endswith('.json'):
+            continue
+        try:
+            pid = int(filename[len('metrics-'):-len('.json')])
+            if pid == os.getpid():
+                continue
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                snapshot = json.load(f)
+            if not isinstance(snapshot, dict):
+                raise ValueError("not a snapshot")
+        except (OSError, ValueError):
+            # A stray or half-written file must not break the scrape
+            logging.warning(f"Skipping unreadable metrics snapshot {filename}")
+            continue
+        yield snapshot, _is_running(pid)
+
+
+def _merge():
+    merged = {name: {} for name in _registry}
+    for snapshot, running in _snapshots():
+        for name, values in snapshot.items():
+            metric = _registry.get(name)
+            if metric is None or (metric.type == 'gauge' and not running):
+                continue
+            totals = merged[name]
+            for key, value in values:
+                key = tuple(key)
+                if metric.type != 'histogram':
+                    totals[key] = totals.get(key, 0) + value
+                    continue
+                counts, total, count = value
+                entry = totals.setdefault(key, [[0] * len(counts), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+    return merged
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [(name, value) for name, value in zip(names, values) if value != ''] + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """
+    Every metric, merged across processes, in the Prometheus text exposition format.
+    """
+    lines = []
+    for name, totals in _merge().items():
+        metric = _registry[name]
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for key, value in sorted(totals.items()):
+            if metric.type != 'histogram':
+                lines.append(f"{name}{_labels(metric.labelnames, key)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _number(float(bound))
+                lines.append(f"{name}_bucket{_labels(metric.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, key)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, key)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+_start_flusher()
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush)
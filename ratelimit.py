@@ -0,0 +1,262 @@
+import os
+import time
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# SQLite file that lets every worker process draw from the same per-channel buckets;
+# empty keeps buckets per process
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', 'ratelimit.db')
+# Adaptive throttling: on a throttle response the rate is multiplied by RATE_LIMIT_DECREASE
+# (at most once per RATE_LIMIT_COOLDOWN seconds, never below RATE_LIMIT_FLOOR of the ceiling);
+# each success adds RATE_LIMIT_INCREASE of the ceiling back
+RATE_LIMIT_DECREASE = float(os.getenv('RATE_LIMIT_DECREASE', '0.5'))
+RATE_LIMIT_INCREASE = float(os.getenv('RATE_LIMIT_INCREASE', '0.02'))
+RATE_LIMIT_FLOOR = float(os.getenv('RATE_LIMIT_FLOOR', '0.05'))
+RATE_LIMIT_COOLDOWN = float(os.getenv('RATE_LIMIT_COOLDOWN', '1'))
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    name TEXT PRIMARY KEY,
+    rate REAL NOT NULL,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    throttled_at REAL NOT NULL DEFAULT 0
+);
+"""
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills at `rate` tokens per second and holds
+    at most `capacity` tokens (defaults to one second's worth).
+    A rate of 0 or less disables limiting.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(self.rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens if they are available right now. Returns True on success.
+        """
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens now, going into debt if needed, without waiting.
+        Returns the number of seconds the caller must wait before using them
+        (async callers sleep on the event loop instead of blocking).
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            # Reserve now and go into debt; callers queue up behind each other in order
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are available, then take them.
+        Returns the number of seconds spent waiting.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """
+    Paces API calls against both a requests-per-minute and a tokens-per-minute budget.
+    Either budget set to 0 or less is not enforced.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=0):
+        self.requests = TokenBucket(requests_per_minute / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, capacity=max(tokens_per_minute / 60.0, 1.0))
+
+    def acquire(self, tokens=1):
+        """
+        Block until one request and `tokens` tokens fit in the budgets.
+        Returns the number of seconds spent waiting.
+        """
+        return self.requests.acquire() + self.tokens.acquire(tokens)
+
+
+def _decreased(rate, ceiling):
+    return max(ceiling * RATE_LIMIT_FLOOR, rate * RATE_LIMIT_DECREASE)
+
+
+def _increased(rate, ceiling):
+    return min(ceiling, rate + ceiling * RATE_LIMIT_INCREASE)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Token bucket whose rate backs off on provider throttling and climbs back on success
+    (additive increase, multiplicative decrease), never above the configured `rate`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self.ceiling = self.rate
+        self._throttled_at = 0.0
+
+    def throttled(self):
+        if self.ceiling <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # Requests already in flight get throttled together; count that as one signal
+            if now - self._throttled_at < RATE_LIMIT_COOLDOWN:
+                return
+            self._throttled_at = now
+            self._refill(now)
+            self.rate = _decreased(self.rate, self.ceiling)
+            self.capacity = max(self.rate, 1.0)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def succeeded(self):
+        if self.ceiling <= 0 or self.rate >= self.ceiling:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = _increased(self.rate, self.ceiling)
+            self.capacity = max(self.rate, 1.0)
+
+
+class SharedTokenBucket:
+    """
+    AdaptiveTokenBucket whose state lives in a SQLite row, so every process using
+    the same db_path draws from (and throttles) one budget.
+    """
+
+    def __init__(self, name, rate, db_path):
+        self.name = name
+        self.ceiling = float(rate)
+        self.db_path = db_path
+        self._local = threading.local()
+        # Rate seen by this process's last transaction; lets succeeded() skip the write at the ceiling
+        self._last_rate = self.ceiling
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SHARED_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _update(self, change):
+        """
+        Run change(rate, tokens, throttled_at, now) -> (rate, tokens, throttled_at, result)
+        on the refilled row inside one write transaction. Returns result.
+        """
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT rate, tokens, updated, throttled_at FROM rate_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                rate, tokens, throttled_at = self.ceiling, max(self.ceiling, 1.0), 0.0
+            else:
+                # The ceiling may have been lowered since the row was written
+                rate = min(row[0], self.ceiling)
+                tokens = min(max(rate, 1.0), row[1] + max(0.0, now - row[2]) * rate)
+                throttled_at = row[3]
+
+            rate, tokens, throttled_at, result = change(rate, tokens, throttled_at, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (name, rate, tokens, updated, throttled_at) VALUES (?, ?, ?, ?, ?)",
+                (self.name, rate, tokens, now, throttled_at)
+            )
+            conn.execute("COMMIT")
+            self._last_rate = rate
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @property
+    def rate(self):
+        return self._update(lambda rate, tokens, throttled_at, now: (rate, tokens, throttled_at, rate))
+
+    def reserve(self, tokens=1):
+        if self.ceiling <= 0:
+            return 0.0
+
+        def take(rate, available, throttled_at, now):
+            available -= tokens
+            wait = -available / rate if available < 0 else 0.0
+            return rate, available, throttled_at, wait
+
+        return self._update(take)
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self):
+        if self.ceiling <= 0:
+            return
+
+        def decrease(rate, available, throttled_at, now):
+            if now - throttled_at < RATE_LIMIT_COOLDOWN:
+                return rate, available, throttled_at, None
+            rate = _decreased(rate, self.ceiling)
+            return rate, min(available, max(rate, 1.0)), now, None
+
+        self._update(decrease)
+
+    def succeeded(self):
+        if self.ceiling <= 0 or self._last_rate >= self.ceiling:
+            return
+
+        def increase(rate, available, throttled_at, now):
+            return _increased(rate, self.ceiling), available, throttled_at, None
+
+        self._update(increase)
+
+
+def get_bucket(name, rate, db_path=None):
+    """
+    The process-wide adaptive bucket for `name` (e.g. a channel), created on first use.
+    Shared across processes through RATE_LIMIT_DB unless that is empty.
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            db_path = RATE_LIMIT_DB if db_path is None else db_path
+            if db_path:
+                bucket = SharedTokenBucket(name, rate, db_path)
+            else:
+                bucket = AdaptiveTokenBucket(rate)
+            _buckets[name] = bucket
+        return bucket
@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Attempts per send including the first; 1 disables retries
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '4'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '1'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '30'))
+
+# Provider failures are (False, message); main.py tags them "(HTTP 503)" / "(SMTP 421)"
+# and reports exceptions as "ExceptionName: detail"
+_STATUS_RE = re.compile(r'\((HTTP|SMTP) (\d{3})\)')
+
+# Refused before the provider acted on it (throttled, or asked to come back later)
+_HTTP_TRANSIENT_STATUSES = {408, 425, 429, 503}
+# Server errors and gateway timeouts come after the provider got the request, which may
+# already have gone out (a Fast2SMS batch, a Twilio message)
+_HTTP_AMBIGUOUS_STATUSES = {500, 502, 504}
+# Only failures before the request went out: re-sending cannot duplicate a message
+_HTTP_TRANSIENT_ERRORS = {
+    'ConnectTimeout',
+    # aiohttp (async_senders)
+    'ClientConnectorError', 'ClientConnectorDNSError', 'ConnectionTimeoutError',
+}
+# requests reports a host it could not connect to as a generic ConnectionError; one of these
+# causes in the message means nothing was sent
+_HTTP_CONNECT_FAILURES = ('NewConnectionError', 'ConnectTimeoutError', 'NameResolutionError')
+# Failures after the request was sent (a read timeout, a connection dropped mid-request):
+# the provider may already have sent the message, so these are dead-lettered, never re-sent
+_HTTP_AMBIGUOUS_ERRORS = {
+    'ConnectionError', 'Timeout', 'ReadTimeout', 'ChunkedEncodingError', 'ConnectionResetError', 'TimeoutError',
+    # aiohttp (async_senders)
+    'ServerDisconnectedError', 'ClientOSError', 'ClientPayloadError', 'ServerTimeoutError', 'SocketTimeoutError',
+}
+# SMTP 4xx replies mean the server did not take the message. A session that could not be
+# opened sent nothing; one that dropped or stalled mid-send may have delivered it.
+_SMTP_TRANSIENT_ERRORS = {'SMTPConnectFailed', 'SMTPConnectError', 'SMTPConnectTimeoutError', 'ConnectionRefusedError'}
+_SMTP_AMBIGUOUS_ERRORS = {
+    'SMTPServerDisconnected', 'SMTPTimeoutError', 'SMTPReadTimeoutError', 'ConnectionResetError', 'TimeoutError',
+}
+
+# Per channel: (transient HTTP statuses, ambiguous HTTP statuses, whether SMTP 4xx replies are
+# transient, transient exception names, ambiguous exception names)
+TRANSIENT_RULES = {
+    'sms': (_HTTP_TRANSIENT_STATUSES, _HTTP_AMBIGUOUS_STATUSES, False, _HTTP_TRANSIENT_ERRORS, _HTTP_AMBIGUOUS_ERRORS),
+    'whatsapp': (_HTTP_TRANSIENT_STATUSES, _HTTP_AMBIGUOUS_STATUSES, False, _HTTP_TRANSIENT_ERRORS, _HTTP_AMBIGUOUS_ERRORS),
+    'call': (_HTTP_TRANSIENT_STATUSES, _HTTP_AMBIGUOUS_STATUSES, False, _HTTP_TRANSIENT_ERRORS, _HTTP_AMBIGUOUS_ERRORS),
+    'email': (set(), set(), True, _SMTP_TRANSIENT_ERRORS, _SMTP_AMBIGUOUS_ERRORS),
+    'null': (_HTTP_TRANSIENT_STATUSES, _HTTP_AMBIGUOUS_STATUSES, False, set(), set()),
+}
+
+# classify() results
+TRANSIENT = 'transient'
+AMBIGUOUS = 'ambiguous'
+
+
+def _error_name(msg):
+    return msg.split(':', 1)[0].strip()
+
+
+def classify(channel, msg):
+    """
+    How a failed send's message is handled:
+    - TRANSIENT: nothing was delivered and the condition may pass (throttling, a provider
+      asking to come back later, a connection that could not be opened): retried.
+    - AMBIGUOUS: the provider got the message but never confirmed it (a server error, a
+      read timeout, a connection dropped mid-send): it may have been delivered, so it is
+      kept as a dead letter and never re-sent automatically.
+    - None: a bad recipient, bad credentials or a rejected message.
+    """
+    rules = TRANSIENT_RULES.get(channel)
+    if rules is None or not msg:
+        return None
+    statuses, ambiguous_statuses, smtp_4xx, errors, ambiguous_errors = rules
+
+    match = _STATUS_RE.search(msg)
+    if match:
+        kind, code = match.group(1), int(match.group(2))
+        if kind == 'SMTP':
+            return TRANSIENT if smtp_4xx and 400 <= code < 500 else None
+        if code in statuses:
+            return TRANSIENT
+        return AMBIGUOUS if code in ambiguous_statuses else None
+
+    name = _error_name(msg)
+    if name in errors:
+        return TRANSIENT
+    if name == 'ConnectionError' and errors is _HTTP_TRANSIENT_ERRORS and any(
+        cause in msg for cause in _HTTP_CONNECT_FAILURES
+    ):
+        return TRANSIENT
+    return AMBIGUOUS if name in ambiguous_errors else None
+
+
+def is_transient(channel, msg):
+    """
+    Whether a failed send is safe and worth retrying (see classify).
+    """
+    return classify(channel, msg) == TRANSIENT
+
+
+def is_ambiguous(channel, msg):
+    """
+    Whether a failed send may still have been delivered (see classify).
+    Such sends are not retried but kept as dead letters.
+    """
+    return classify(channel, msg) == AMBIGUOUS
+
+
+def backoff(attempt):
+    """
+    Delay before retry number `attempt` (1-based): exponential with full jitter,
+    so a burst of failures does not come back as a synchronized burst of retries.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+class RetryScheduler:
+    """
+    Runs sends on an executor and retries transient failures after a backoff.
+
+    Waiting retries sit in a timer heap, not in a worker thread, so the executor keeps
+    sending to other contacts meanwhile. submit() returns a Future resolved with the
+    final (success, msg); its gave_up attribute tells whether it ended on a transient
+    failure after exhausting every attempt, or on an ambiguous one (see is_ambiguous)
+    that was not retried.
+    """
+
+    def __init__(self, executor, max_attempts=None):
+        self.executor = executor
+        self.max_attempts = max_attempts or RETRY_MAX_ATTEMPTS
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='retry-timer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, channel, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs) -> (success, msg) on the executor, retrying transient failures.
+        Returns a Future for the final result.
+        """
+        result = Future()
+        result.gave_up = False
+        self._attempt(result, 1, channel, fn, args, kwargs)
+        return result
+
+    def _attempt(self, result, attempt, channel, fn, args, kwargs):
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except RuntimeError as e:
+            # Executor already shut down
+            result.set_result((False, f"{type(e).__name__}: {e}"))
+            return
+        future.add_done_callback(lambda done: self._done(done, result, attempt, channel, fn, args, kwargs))
+
+    def _done(self, done, result, attempt, channel, fn, args, kwargs):
+        try:
+            success, msg = done.result()
+        except Exception as e:
+            logging.error("Exception while sending", exc_info=True)
+            success, msg = False, f"{type(e).__name__}: {e}"
+
+        outcome = None if success else classify(channel, msg)
+        if outcome == AMBIGUOUS:
+            result.gave_up = True
+            metrics.DEAD_LETTERS.inc(channel=channel)
+            result.set_result((False, f"{msg} (not retried: the provider may have accepted it)"))
+        elif outcome != TRANSIENT:
+            result.set_result((success, msg))
+        elif attempt >= self.max_attempts or self._closed:
+            result.gave_up = True
+            metrics.DEAD_LETTERS.inc(channel=channel)
+            result.set_result((False, f"{msg} (gave up after {attempt} attempts)"))
+        else:
+            delay = backoff(attempt)
+            metrics.SEND_RETRIES.inc(channel=channel)
+            logging.warning(f"Transient {channel} failure, retry {attempt} in {delay:.1f}s: {msg}")
+            self._schedule(delay, lambda: self._attempt(result, attempt + 1, channel, fn, args, kwargs))
+
+    def _schedule(self, delay, callback):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), callback))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._closed and not self._heap:
+                    return
+                _, _, callback = heapq.heappop(self._heap)
+            callback()
+
+    def close(self):
+        """
+        Stop the timer once queued retries have been handed to the executor.
+        Call after every submitted Future has resolved.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
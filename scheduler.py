@@ -0,0 +1,214 @@
+"""
+Scheduled and paced campaign delivery.
+
+A campaign may be queued for a future time (jobs.run_at) and/or spread over a window
+("5,000 SMS over 2 hours"): its contacts are then released to the dispatcher a slice per
+SCHEDULER_TICK at an even pace of window / total, instead of as fast as the channels allow.
+Optional per-channel daily caps are counted here across every campaign and process: a
+slice is charged to the cap as it is released, and the dispatcher's unsent contacts
+(invalid, already delivered) are refunded, so only send attempts count.
+
+Pacing state lives in SQLite (SCHEDULER_DB), so it survives restarts: a campaign picked
+up again releases the contacts it had already released straight away (the delivery
+ledger skips those delivered, refunding their charge) and carries on at the same pace
+from there.
+A campaign whose next release is more than SCHEDULER_MAX_WAIT away (a very slow pace, a
+daily cap reached) raises Deferred so its worker can requeue it for then and move on.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCHEDULER_DB = os.getenv('SCHEDULER_DB', 'scheduler.db')
+# Seconds between releases of a paced campaign's contacts
+SCHEDULER_TICK = float(os.getenv('SCHEDULER_TICK', '1'))
+# Longest a worker sleeps for a paced campaign's next release before handing the job back
+SCHEDULER_MAX_WAIT = float(os.getenv('SCHEDULER_MAX_WAIT', '60'))
+# Sends per channel per (local) day across all campaigns; 0 for no cap
+DAILY_CAPS = {
+    'sms': int(os.getenv('DAILY_CAP_SMS', '0')),
+    'email': int(os.getenv('DAILY_CAP_EMAIL', '0')),
+    'whatsapp': int(os.getenv('DAILY_CAP_WHATSAPP', '0')),
+    'call': int(os.getenv('DAILY_CAP_CALL', '0')),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaign_pacing (
+    campaign_id TEXT PRIMARY KEY,
+    interval REAL NOT NULL,
+    released INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_sends (
+    channel TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sent INTEGER NOT NULL,
+    PRIMARY KEY (channel, day)
+) WITHOUT ROWID;
+"""
+
+
+class Deferred(Exception):
+    """
+    The campaign's next release is at run_at (epoch seconds); requeue it for then.
+    """
+
+    def __init__(self, run_at, reason):
+        super().__init__(f"{reason}; next release at {datetime.fromtimestamp(run_at):%Y-%m-%d %H:%M:%S}")
+        self.run_at = run_at
+
+
+def _next_midnight(now):
+    tomorrow = datetime.fromtimestamp(now).date() + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+
+class Scheduler:
+    """
+    Campaign pacing and daily send counts in SQLite. One instance may be shared by threads.
+    """
+
+    def __init__(self, db_path=None):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path or SCHEDULER_DB, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _pacing(self, campaign_id, spread_seconds, count):
+        """
+        Returns the campaign's (seconds between contacts, contacts already released),
+        fixing the pace on its first run.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT interval, released FROM campaign_pacing WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone()
+        if row is not None:
+            return row
+
+        # Counting may parse a whole sheet, so it happens outside the lock
+        interval = spread_seconds / max(count(), 1) if spread_seconds and count is not None else 0.0
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO campaign_pacing (campaign_id, interval, released, updated_at) VALUES (?, ?, 0, ?)",
+                (campaign_id, interval, time.time())
+            )
+        return interval, 0
+
+    def _released(self, campaign_id, released):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE campaign_pacing SET released = ?, updated_at = ? WHERE campaign_id = ?",
+                (released, time.time(), campaign_id)
+            )
+
+    def reserve(self, modes, count):
+        """
+        Take up to `count` sends from today's cap of every capped channel in modes
+        (a campaign's own channels; sends to fallback channels are not counted).
+        Contacts taken but then not sent are given back with refund().
+        Returns how many may be sent now (0 once a cap is reached for the day).
+        """
+        capped = [mode for mode in modes if DAILY_CAPS.get(mode)]
+        if not capped:
+            return count
+
+        day = datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for mode in capped:
+                    row = self._conn.execute(
+                        "SELECT sent FROM daily_sends WHERE channel = ? AND day = ?", (mode, day)
+                    ).fetchone()
+                    count = max(0, min(count, DAILY_CAPS[mode] - (row[0] if row else 0)))
+                if count:
+                    self._conn.executemany(
+                        "INSERT INTO daily_sends (channel, day, sent) VALUES (?, ?, ?) "
+                        "ON CONFLICT (channel, day) DO UPDATE SET sent = sent + excluded.sent",
+                        [(mode, day, count) for mode in capped]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def refund(self, mode, count):
+        """
+        Give back `count` of today's sends on mode, taken by reserve() for contacts that
+        were not sent after all.
+        """
+        if not DAILY_CAPS.get(mode) or not count:
+            return
+        day = datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            self._conn.execute(
+                "UPDATE daily_sends SET sent = MAX(0, sent - ?) WHERE channel = ? AND day = ?", (count, mode, day)
+            )
+
+    def _wait_until(self, run_at, reason):
+        delay = run_at - time.time()
+        if delay > SCHEDULER_MAX_WAIT:
+            raise Deferred(run_at, reason)
+        if delay > 0:
+            time.sleep(delay)
+
+    def paced(self, campaign_id, chunks, modes, spread_seconds=None, count=None):
+        """
+        Re-chunk a campaign's contact stream into slices released on schedule.
+        With spread_seconds, count() is called once, on the campaign's first run, to fix
+        the pace at spread_seconds / count(); without it slices go out as fast as the
+        dispatcher takes them, subject only to DAILY_CAPS for modes. Every contact
+        released is reserved from the caps, so the caller refunds those it does not send.
+        Raises Deferred (from the iteration) when the next release is far off.
+        """
+        interval, released = self._pacing(campaign_id, spread_seconds, count)
+        if released:
+            logging.info(f"Campaign {campaign_id}: {released} contact(s) already released, resuming the schedule")
+
+        position = 0
+        next_at = time.time()
+        for contacts in chunks:
+            start = 0
+            while start < len(contacts):
+                # Released in an earlier run: the ledger skips the ones delivered, the rest are overdue
+                overdue = position < released
+                size = len(contacts) - start
+                if overdue:
+                    size = min(size, released - position)
+                else:
+                    self._wait_until(next_at, "Paced campaign")
+                    if interval:
+                        size = min(size, max(1, int(SCHEDULER_TICK / interval)))
+                size = self.reserve(modes, size)
+                if not size:
+                    self._wait_until(_next_midnight(time.time()), "Daily send cap reached")
+                    continue
+
+                slot = max(next_at, time.time())
+                yield contacts[start:start + size]
+                # The slice has been dispatched by the time the stream is read again
+                start += size
+                position += size
+                if not overdue:
+                    self._released(campaign_id, position)
+                    next_at = slot + interval * size
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+import logging
+import aiosmtplib
+from email.utils import getaddresses
+from dotenv import load_dotenv
+
+import metrics
+import event_loop
+from attachments import flatten_message
+
+load_dotenv()
+
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '30'))
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '4'))
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', '60'))
+SMTP_MAX_MESSAGES = int(os.getenv('SMTP_MAX_MESSAGES', '100'))
+
+
+class SMTPConnectFailed(aiosmtplib.SMTPException):
+    """
+    No session could be opened (refused, timed out, dropped during the handshake),
+    so nothing was sent and the send is safe to retry.
+    """
+
+
+class _SMTP(aiosmtplib.SMTP):
+    """
+    aiosmtplib.SMTP that notes when a message reaches the DATA phase: a session dropped
+    before then cannot have delivered it, one dropped after may have.
+    """
+    in_data = False
+
+    async def data(self, *args, **kwargs):
+        self.in_data = True
+        return await super().data(*args, **kwargs)
+
+
+class _PooledConnection:
+    """
+    A logged-in SMTP session plus the bookkeeping the pool needs
+    to decide when it is too old or too used to hand out again.
+    """
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class AsyncSMTPPool:
+    """
+    Pool of authenticated SMTP sessions shared by every email in a batch, used from
+    coroutines on one event loop (see async_senders.send_email_async).
+
+    - At most `size` sessions are open at once; callers wait until one is free.
+    - Sessions idle for longer than `idle_timeout` seconds are closed, not reused.
+    - Sessions are recycled after `max_messages` sends (Gmail drops long sessions).
+    - A session the server dropped before the message was sent (typically a stale idle
+      one) is reconnected once and the send retried. A drop once DATA has begun is
+      raised instead: the server may have taken the message, so resending could
+      deliver it twice.
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None,
+                 size=None, idle_timeout=None, max_messages=None,
+                 use_tls=None, timeout=None):
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.username = username if username is not None else os.getenv('EMAIL_ADDRESS')
+        self.password = password if password is not None else os.getenv('EMAIL_PASSWORD')
+        self.size = size or SMTP_POOL_SIZE
+        self.idle_timeout = idle_timeout if idle_timeout is not None else SMTP_IDLE_TIMEOUT
+        self.max_messages = max_messages or SMTP_MAX_MESSAGES
+        self.use_tls = SMTP_USE_TLS if use_tls is None else use_tls
+        self.timeout = timeout or SMTP_TIMEOUT
+
+        # Most recently used last
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.size)
+        self._closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _connect(self):
+        smtp = _SMTP(hostname=self.host, port=self.port, start_tls=self.use_tls, timeout=self.timeout)
+        try:
+            with metrics.timer('smtp_connect', 'email'):
+                await smtp.connect()
+                # Local stand-ins (aiosmtpd, smtpd) usually do not advertise AUTH
+                if self.username and self.password and smtp.supports_extension('auth'):
+                    await smtp.login(self.username, self.password)
+        except aiosmtplib.SMTPResponseException:
+            # A reply from the server (bad credentials, refused TLS) is reported as is
+            smtp.close()
+            raise
+        except OSError as e:
+            smtp.close()
+            raise SMTPConnectFailed(f"{self.host}:{self.port}: {type(e).__name__}: {e}") from e
+        logging.info(f"Opened SMTP session to {self.host}:{self.port}")
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    async def _discard(conn):
+        try:
+            await conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    async def _checkout(self):
+        # Reuse the most recently used session unless it has gone stale
+        while self._idle:
+            conn = self._idle.pop()
+            if time.monotonic() - conn.last_used > self.idle_timeout:
+                await self._discard(conn)
+                continue
+            return conn
+        return await self._connect()
+
+    async def _checkin(self, conn):
+        conn.last_used = time.monotonic()
+        if self._closed or conn.sent >= self.max_messages:
+            await self._discard(conn)
+        else:
+            self._idle.append(conn)
+
+    @staticmethod
+    async def _sendmail(conn, from_addr, to_addrs, data):
+        conn.smtp.in_data = False
+        await conn.smtp.sendmail(from_addr, to_addrs, data)
+
+    async def send_message(self, msg):
+        """
+        Send an EmailMessage over a pooled session.
+        Raises SMTPConnectFailed if no session could be opened, otherwise whatever
+        aiosmtplib raises if the send fails.
+        """
+        if self._closed:
+            raise RuntimeError("SMTP pool is closed")
+
+        # Serialize once, outside the session; shared attachment bodies are copied, not re-encoded
+        from_addr = msg['Sender'] or msg['From']
+        to_addrs = [addr for _, addr in getaddresses(msg.get_all('To', []) + msg.get_all('Cc', []) + msg.get_all('Bcc', []))]
+        del msg['Bcc']
+        data = flatten_message(msg)
+
+        async with self._slots:
+            conn = await self._checkout()
+            try:
+                try:
+                    await self._sendmail(conn, from_addr, to_addrs, data)
+                except aiosmtplib.SMTPServerDisconnected:
+                    if conn.smtp.in_data:
+                        raise
+                    logging.warning("SMTP session dropped by server before sending, reconnecting")
+                    conn.smtp.close()
+                    conn = await self._connect()
+                    await self._sendmail(conn, from_addr, to_addrs, data)
+            except Exception:
+                # Never return a session in an unknown state to the pool
+                conn.smtp.close()
+                raise
+            conn.sent += 1
+            await self._checkin(conn)
+
+    async def close(self):
+        self._closed = True
+        while self._idle:
+            await self._discard(self._idle.pop())
+
+
+class SMTPPool:
+    """
+    Blocking front for AsyncSMTPPool, for sync callers: sends run on the shared event
+    loop (see event_loop.py). Takes the same arguments; `pool` is the AsyncSMTPPool,
+    which async_senders and the channels use directly.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.pool = AsyncSMTPPool(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send_message(self, msg):
+        """
+        Send an EmailMessage over a pooled session (see AsyncSMTPPool.send_message).
+        """
+        event_loop.run(self.pool.send_message(msg))
+
+    def close(self):
+        event_loop.run(self.pool.close())
@@ -0,0 +1,128 @@
+import os
+import sys
+import unittest
+from collections import Counter
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('METRICS_DIR', '')
+os.environ.setdefault('RATE_LIMIT_DB', '')
+
+import main
+import channels
+import dispatcher
+import retry
+
+
+@channels.register
+class _RejectingChannel(channels.Channel):
+    name = 'test_reject'
+
+    def send(self, content, value, name=None):
+        return False, f"Rejected {value}"
+
+
+@channels.register
+class _MailChannel(channels.Channel):
+    name = 'test_mail'
+    field = 'email'
+
+    def send(self, content, value, name=None):
+        return True, f"Mailed {value}"
+
+
+def _contacts(count):
+    return [{'name': f'C{i}', 'phone': f'98765{i:05d}', 'email': f'c{i}@example.com'} for i in range(count)]
+
+
+class DispatchMultiTest(unittest.TestCase):
+
+    def _run(self, modes, fallbacks=None, contacts=None, **kwargs):
+        calls = Counter()
+        outcomes = []
+
+        def on_result(contact, success, msg):
+            calls[contact['name']] += 1
+            outcomes.append(success)
+
+        successes, failures = dispatcher.dispatch_multi(
+            [contacts or _contacts(5)], modes, 'yes', 'hi', fallbacks=fallbacks, on_result=on_result, **kwargs
+        )
+        return calls, outcomes, successes, failures
+
+    def test_each_contact_reported_once_per_channel(self):
+        calls, outcomes, successes, failures = self._run(['null', 'test_reject'])
+        self.assertEqual(set(calls.values()), {2})
+        self.assertEqual(len(calls), 5)
+        self.assertEqual((len(successes), len(failures)), (5, 5))
+        self.assertEqual(outcomes.count(False), 5)
+
+    def test_fallback_reports_once_per_contact(self):
+        calls, _, successes, failures = self._run(['test_reject'], fallbacks={'test_reject': 'test_mail'})
+        self.assertEqual(set(calls.values()), {1})
+        self.assertEqual((len(successes), len(failures)), (5, 0))
+        self.assertTrue(all(msg.startswith('test_reject: Rejected') and 'test_mail: Mailed' in msg for _, msg in successes))
+
+    def test_invalid_contact_falls_back(self):
+        contacts = _contacts(2) + [{'name': 'X', 'phone': '12', 'email': 'x@example.com'}]
+        calls, _, successes, failures = self._run(['null'], fallbacks={'null': 'test_mail'}, contacts=contacts)
+        self.assertEqual(set(calls.values()), {1})
+        self.assertEqual((len(successes), len(failures)), (3, 0))
+
+    def test_dead_letters_name_their_channel(self):
+        dead_letters = []
+        with mock.patch.object(channels, 'NULL_CHANNEL_FAILURE_RATE', 1.0), \
+                mock.patch.object(retry, 'RETRY_MAX_ATTEMPTS', 2), mock.patch.object(retry, 'RETRY_BASE_DELAY', 0.01):
+            calls, _, successes, failures = self._run(
+                ['test_mail', 'null'], on_dead_letter=lambda contact, msg, mode: dead_letters.append(mode)
+            )
+        self.assertEqual(set(calls.values()), {2})
+        self.assertEqual((len(successes), len(failures)), (5, 5))
+        self.assertEqual(dead_letters, ['null'] * 5)
+
+    def test_unsent_contacts_reported_per_channel(self):
+        unsent = Counter()
+        contacts = _contacts(2) + [{'name': 'X', 'phone': '12', 'email': 'x@example.com'}]
+        self._run(
+            ['null'], fallbacks={'null': 'test_mail'}, contacts=contacts,
+            on_unsent=lambda mode, count: unsent.update({mode: count})
+        )
+        # The bad phone is never sent on null; test_mail only gets that one contact
+        self.assertEqual(unsent, Counter({'null': 1}))
+
+    def test_inconsistent_fallbacks_rejected(self):
+        for modes, fallbacks in [
+            (['null', 'test_mail'], {'null': 'test_mail'}),
+            (['null'], {'null': 'test_mail', 'test_mail': 'null'}),
+            (['null'], {'sms': 'test_mail'}),
+            (['nope'], {}),
+        ]:
+            with self.assertRaises(ValueError):
+                dispatcher.dispatch_multi([[]], modes, 'yes', 'hi', fallbacks=fallbacks)
+
+
+
+class _EchoWhatsAppChannel(channels.WhatsAppChannel):
+
+    async def send_async(self, content, value, name=None):
+        return True, f"{content} to {value}"
+
+
+class SendWhatsAppManyTest(unittest.TestCase):
+
+    def test_results_in_input_order(self):
+        numbers = ['9876500001', 'bad', '+919876500002', '+919876500001']
+        with mock.patch.dict(channels.CHANNELS, {'whatsapp': _EchoWhatsAppChannel()}):
+            results = main.send_whatsapp_many('hi', numbers)
+        self.assertEqual(results[0], (True, "hi to +919876500001"))
+        self.assertFalse(results[1][0])
+        self.assertEqual(results[2], (True, "hi to +919876500002"))
+        # The same number again is not sent twice
+        self.assertFalse(results[3][0])
+        self.assertIn("Duplicate", results[3][1])
+
+    def test_no_numbers(self):
+        self.assertEqual(main.send_whatsapp_many('hi', []), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('METRICS_DIR', '')
+
+import retry
+
+CONNECT_REFUSED = (
+    "ConnectionError: HTTPSConnectionPool(host='www.fast2sms.com', port=443): Max retries exceeded "
+    "(Caused by NewConnectionError('Failed to establish a new connection: [Errno 111] Connection refused'))"
+)
+CONNECTION_ABORTED = "ConnectionError: ('Connection aborted.', RemoteDisconnected('Remote end closed connection'))"
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def assertClass(self, channel, msg, expected):
+        self.assertEqual(retry.classify(channel, msg), expected, msg)
+
+    def test_http_refusals_are_transient(self):
+        for status in (408, 425, 429, 503):
+            self.assertClass('sms', f"SMS failed (HTTP {status}): try later", retry.TRANSIENT)
+        self.assertClass('whatsapp', "WhatsApp failed (HTTP 429): Too Many Requests", retry.TRANSIENT)
+
+    def test_http_server_errors_are_ambiguous(self):
+        for status in (500, 502, 504):
+            self.assertClass('sms', f"SMS failed (HTTP {status}): upstream error", retry.AMBIGUOUS)
+            self.assertFalse(retry.is_transient('sms', f"SMS failed (HTTP {status}): upstream error"))
+        self.assertClass('call', "Call failed (HTTP 504): Gateway Timeout", retry.AMBIGUOUS)
+
+    def test_http_connect_failures_are_transient(self):
+        self.assertClass('sms', "ConnectTimeout: connect timed out", retry.TRANSIENT)
+        self.assertClass('sms', CONNECT_REFUSED, retry.TRANSIENT)
+        self.assertClass('call', "ClientConnectorError: Cannot connect to host twilix.exotel.in:443", retry.TRANSIENT)
+
+    def test_http_failures_after_sending_are_ambiguous(self):
+        for msg in ("ReadTimeout: read timed out", CONNECTION_ABORTED, "ChunkedEncodingError: incomplete read",
+                    "ServerDisconnectedError: Server disconnected", "SocketTimeoutError: Timeout on reading data"):
+            self.assertClass('whatsapp', msg, retry.AMBIGUOUS)
+
+    def test_smtp(self):
+        self.assertClass('email', "Email failed (SMTP 421): try again later", retry.TRANSIENT)
+        self.assertClass('email', "ConnectionRefusedError: [Errno 111] Connection refused", retry.TRANSIENT)
+        self.assertClass('email', "SMTPConnectFailed: smtp.example.com:587: TimeoutError: timed out", retry.TRANSIENT)
+        for msg in ("SMTPServerDisconnected: Connection unexpectedly closed", "TimeoutError: timed out",
+                    "SMTPReadTimeoutError: Timed out waiting for server response",
+                    "ConnectionResetError: [Errno 104] Connection reset by peer"):
+            self.assertClass('email', msg, retry.AMBIGUOUS)
+
+    def test_permanent_failures(self):
+        for channel, msg in [
+            ('sms', "SMS failed (HTTP 400): invalid number"),
+            ('whatsapp', "WhatsApp failed (HTTP 401): Authenticate"),
+            ('email', "Email failed (SMTP 550): mailbox unavailable"),
+            ('sms', "Invalid phone number: 12"),
+            ('email', ""),
+            ('unknown', "SMS failed (HTTP 503): down"),
+        ]:
+            self.assertClass(channel, msg, None)
+
+
+class RetrySchedulerTest(unittest.TestCase):
+
+    def _send(self, channel, replies):
+        calls = []
+
+        def send():
+            calls.append(1)
+            return replies[min(len(calls), len(replies)) - 1]
+
+        with mock.patch.object(retry, 'RETRY_BASE_DELAY', 0.01), ThreadPoolExecutor(2) as executor, \
+                retry.RetryScheduler(executor, max_attempts=3) as retrier:
+            future = retrier.submit(channel, send)
+            return future.result(), future.gave_up, len(calls)
+
+    def test_transient_failure_retried(self):
+        result, gave_up, calls = self._send('sms', [(False, "SMS failed (HTTP 503): down"), (True, "SMS sent")])
+        self.assertEqual((result, gave_up, calls), ((True, "SMS sent"), False, 2))
+
+    def test_transient_failure_gives_up(self):
+        (success, msg), gave_up, calls = self._send('sms', [(False, "SMS failed (HTTP 429): slow down")])
+        self.assertEqual((success, gave_up, calls), (False, True, 3))
+
+    def test_ambiguous_failure_never_resent(self):
+        for channel, msg in [('sms', "SMS failed (HTTP 504): Gateway Timeout"), ('email', "TimeoutError: timed out")]:
+            (success, result_msg), gave_up, calls = self._send(channel, [(False, msg), (True, "sent")])
+            self.assertEqual((success, gave_up, calls), (False, True, 1))
+            self.assertIn("may have accepted it", result_msg)
+
+    def test_permanent_failure_not_retried(self):
+        result, gave_up, calls = self._send('sms', [(False, "SMS failed (HTTP 400): bad number")])
+        self.assertEqual((result[0], gave_up, calls), (False, False, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
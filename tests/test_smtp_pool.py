@@ -0,0 +1,113 @@
+import os
+import sys
+import socket
+import socketserver
+import threading
+import unittest
+import aiosmtplib
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('METRICS_DIR', '')
+
+import smtp_pool
+
+
+class _FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal SMTP server. server.drops lists, per connection, the command on which to hang
+    up ('MAIL', or 'END' once the message body has been received), or None.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            drop = server.drops.pop(0) if server.drops else None
+        self.reply("220 fake ready")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply("250 fake")
+            elif command == 'MAIL':
+                if drop == 'MAIL':
+                    return
+                self.reply("250 OK")
+            elif command == 'RCPT':
+                self.reply("250 OK")
+            elif command == 'DATA':
+                self.reply("354 go ahead")
+                while self.rfile.readline().rstrip(b'\r\n') != b'.':
+                    pass
+                with server.lock:
+                    server.received += 1
+                if drop == 'END':
+                    return
+                self.reply("250 queued")
+            elif command == 'QUIT':
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _FakeSMTPHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.drops = []
+        self.server.received = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.pool = smtp_pool.SMTPPool(
+            host='127.0.0.1', port=self.server.server_address[1], username='', password='', use_tls=False, size=1
+        )
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _message(self):
+        msg = EmailMessage()
+        msg['From'] = 'from@example.com'
+        msg['To'] = 'to@example.com'
+        msg.set_content("hello")
+        return msg
+
+    def test_drop_before_sending_reconnects_once(self):
+        self.server.drops = ['MAIL']
+        self.pool.send_message(self._message())
+        self.assertEqual(self.server.received, 1)
+
+    def test_drop_after_data_is_not_resent(self):
+        self.server.drops = ['END']
+        with self.assertRaises(aiosmtplib.SMTPServerDisconnected):
+            self.pool.send_message(self._message())
+        self.assertEqual(self.server.received, 1)
+
+
+class SMTPConnectFailureTest(unittest.TestCase):
+
+    def test_connect_failure_is_marked(self):
+        # A port nothing listens on
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        msg = EmailMessage()
+        msg['From'] = 'from@example.com'
+        msg['To'] = 'to@example.com'
+        msg.set_content("hello")
+        with smtp_pool.SMTPPool(host='127.0.0.1', port=port, username='', password='', use_tls=False, timeout=2) as pool:
+            with self.assertRaises(smtp_pool.SMTPConnectFailed):
+                pool.send_message(msg)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+
+# Throttled: the request was refused, so another attempt after a backoff cannot duplicate it
+RETRY_STATUSES = (429,)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port
+
+
+def build_adapter(retry_statuses=RETRY_STATUSES):
+    """
+    HTTPAdapter with the shared pool size and retry policy, for clients
+    (such as Twilio's) that manage their own requests.Session.
+    A POST is retried only when it cannot have been acted on: the connection failed
+    before the request was sent, or the response is one of retry_statuses. A read
+    timeout or a connection dropped mid-request is never retried, since the provider
+    may already have sent the message.
+    """
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        # False re-raises the read error as is (requests.ReadTimeout), not as a retry-exhausted ConnectionError
+        read=False,
+        other=0,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=retry_statuses,
+        # Status retries only; read retries are off above (provider calls are all POSTs)
+        allowed_methods=frozenset({'POST'}),
+        # urllib3 retries any 429 carrying Retry-After, so tie it to whether 429 is ours to retry
+        respect_retry_after_header=429 in retry_statuses,
+        raise_on_status=False,  # Hand the last response back so callers can report it
+    )
+    return HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+
+
+def _build_session(retry_statuses):
+    adapter = build_adapter(retry_statuses)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(url, retry_statuses=RETRY_STATUSES):
+    """
+    Returns the keep-alive session for the URL's host, creating it on first use.
+    Sessions are shared by every thread in the process.
+    """
+    key = _host_key(url) + (tuple(retry_statuses),)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _build_session(retry_statuses)
+    return session
+
+
+def post(url, timeout=None, retry_statuses=RETRY_STATUSES, **kwargs):
+    """
+    requests.post over the pooled session for the URL's host, with default
+    (connect, read) timeouts and retry-with-backoff on retry_statuses (429 by default).
+    Callers that handle throttling themselves can pass statuses without 429.
+    """
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    return get_session(url, retry_statuses).post(url, timeout=timeout, **kwargs)
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,201 @@
+"""
+Uploaded sheets, streamed to disk and stored by content hash.
+
+SpoolingRequest makes Flask write every uploaded file straight into UPLOAD_SPOOL_DIR as
+it arrives, hashing it on the way, so a large workbook is never held in memory or copied
+again. spool_sheet() then moves the sheet to <sha256><ext>; an identical re-upload lands
+on the same file. The contacts parsed from a sheet are cached next to it, so a sheet that
+has been parsed once (re-uploaded, or a resumed campaign) is never parsed again.
+Files no job still reads are deleted by purge_spool once UPLOAD_RETENTION_DAYS old.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+from collections import namedtuple
+from dotenv import load_dotenv
+from flask import Request
+from werkzeug.utils import secure_filename
+
+from utils import iter_contacts
+
+load_dotenv()
+
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR', 'uploads')
+# Days a spooled sheet, its parsed contacts or an abandoned upload is kept unless a job still reads it
+UPLOAD_RETENTION_DAYS = float(os.getenv('UPLOAD_RETENTION_DAYS', '7'))
+# Bytes per read when a stream has to be copied and hashed after the fact
+COPY_CHUNK_SIZE = 1024 * 1024
+
+SpooledSheet = namedtuple('SpooledSheet', ['filename', 'path', 'digest'])
+
+
+class SpooledUpload:
+    """
+    Writable, readable and seekable temporary file in UPLOAD_SPOOL_DIR that keeps a
+    sha256 of everything written to it. Deleted on close unless claim()ed.
+    """
+
+    def __init__(self, directory=None):
+        directory = directory or UPLOAD_SPOOL_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f".upload-{uuid.uuid4().hex}.tmp")
+        self._file = open(self.path, 'w+b')
+        self._hash = hashlib.sha256()
+        self._claimed = False
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def claim(self, path):
+        """
+        Keep the upload as `path` (replacing an identical earlier upload, if any).
+        The open file stays readable.
+        """
+        self._file.flush()
+        os.replace(self.path, path)
+        self.path = path
+        self._claimed = True
+
+    def close(self):
+        self._file.close()
+        if not self._claimed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        # read, seek, tell, readline, ... from the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class SpoolingRequest(Request):
+    """
+    Request whose file uploads are written to UPLOAD_SPOOL_DIR as they stream in.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledUpload()
+
+
+def _sheet_path(digest, extension):
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{digest}{extension}")
+
+
+def _contacts_path(digest):
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{digest}.contacts.jsonl")
+
+
+def spool_sheet(file_storage):
+    """
+    Store an uploaded sheet under its content hash.
+    Returns a SpooledSheet (original filename, path on disk, sha256 hex digest).
+    """
+    extension = os.path.splitext(secure_filename(file_storage.filename or ''))[1].lower()
+    stream = file_storage.stream
+
+    if isinstance(stream, SpooledUpload):
+        digest = stream.hexdigest()
+        stream.claim(_sheet_path(digest, extension))
+    else:
+        # Uploads not received through SpoolingRequest: copy and hash in chunks
+        os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+        tmp_path = os.path.join(UPLOAD_SPOOL_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+        sha = hashlib.sha256()
+        with open(tmp_path, 'wb') as out:
+            while True:
+                data = stream.read(COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                sha.update(data)
+                out.write(data)
+        digest = sha.hexdigest()
+        os.replace(tmp_path, _sheet_path(digest, extension))
+
+    if hasattr(stream, 'seek'):
+        stream.seek(0)
+    return SpooledSheet(file_storage.filename, _sheet_path(digest, extension), digest)
+
+
+def is_parsed(digest):
+    """
+    Whether contacts for this sheet content are already cached.
+    """
+    return os.path.exists(_contacts_path(digest))
+
+
+def iter_sheet_contacts(path, filename=None, digest=None):
+    """
+    iter_contacts for a spooled sheet, served from the parsed-contacts cache when this
+    content has been parsed before. A first, complete parse fills the cache as it goes.
+    """
+    if digest is None:
+        yield from iter_contacts(path, filename=filename)
+        return
+
+    cache_path = _contacts_path(digest)
+    try:
+        cached = open(cache_path)
+    except FileNotFoundError:
+        cached = None
+    if cached is not None:
+        logging.info(f"Using cached contacts for sheet {digest[:12]}")
+        with cached:
+            for line in cached:
+                yield json.loads(line)
+        return
+
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    complete = False
+    try:
+        with open(tmp_path, 'w') as out:
+            for chunk in iter_contacts(path, filename=filename):
+                out.write(json.dumps(chunk) + '\n')
+                yield chunk
+        complete = True
+    finally:
+        # A parse that failed or was abandoned part-way is not cached
+        if complete:
+            os.replace(tmp_path, cache_path)
+        else:
+            os.remove(tmp_path)
+
+
+def purge_spool(keep=(), retention_days=None):
+    """
+    Delete spooled files (sheets, parsed-contact caches, abandoned uploads) not modified
+    for retention_days (UPLOAD_RETENTION_DAYS by default), except those of the sheet
+    digests in keep. Returns the number of files deleted.
+    """
+    retention_days = UPLOAD_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = time.time() - retention_days * 86400
+    try:
+        entries = os.scandir(UPLOAD_SPOOL_DIR)
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    with entries:
+        for entry in entries:
+            # <digest><ext>, <digest>.contacts.jsonl[.<uuid>.tmp] or .upload-<uuid>.tmp
+            if entry.name.split('.', 1)[0] in keep or not entry.is_file():
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    if removed:
+        logging.info(f"Deleted {removed} spooled upload file(s) older than {retention_days:g} day(s)")
+    return removed
@@ -1,41 +1,183 @@
+import os
+import logging
 import pandas as pd
+from openpyxl import load_workbook
 
 REQUIRED_COLUMNS = ['Name', 'Phone', 'Email']
+SHEET_EXTENSIONS = ['.xlsx', '.xls', '.csv']
 
+# Contacts handed to the dispatcher at a time when streaming a sheet
+CONTACT_CHUNK_SIZE = int(os.getenv('CONTACT_CHUNK_SIZE', '5000'))
 
-def parse_excel(file_storage):
+
+class SheetError(ValueError):
     """
-    Parses an uploaded Excel file from Flask's FileStorage object.
-    Returns a tuple: (list of contact dicts, message)
+    The sheet is readable but unusable (e.g. required columns missing).
+    The message is ready to show to the user.
+    """
+
+
+def _sheet_format(source, filename=None):
+    """
+    File extension of the sheet: from filename, a FileStorage's filename, or a path.
+    """
+    name = filename or getattr(source, 'filename', None) or (source if isinstance(source, str) else '')
+    return os.path.splitext(name)[1].lower() or '.xlsx'
+
+
+def _stream(source):
+    # FileStorage wraps the real (possibly disk-spooled) file object
+    return getattr(source, 'stream', source)
+
+
+def _missing_message(columns):
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        return f"❌ Missing required columns: {', '.join(missing_columns)}"
+    return None
+
+
+def _clean_frame(df):
+    """
+    Vectorized cleanup of one block of rows: stringify, strip, fix Excel's float phone
+    numbers and drop rows missing any required field.
+    Returns a tuple: (clean DataFrame, sheet row numbers that were skipped)
+    """
+    df = df[REQUIRED_COLUMNS].fillna('').astype(str)
+    for col in REQUIRED_COLUMNS:
+        df[col] = df[col].str.strip()
+    df['Phone'] = df['Phone'].str.replace(r'\.0$', '', regex=True)
+
+    complete = (df != '').all(axis=1)
+    # DataFrame index 0 is sheet row 2 (row 1 is the header)
+    skipped = (df.index[~complete] + 2).tolist()
+    return df[complete], skipped
+
+
+def _iter_xlsx_frames(source, chunk_size):
+    """
+    Read-only openpyxl reader: yields DataFrames of at most chunk_size rows
+    without ever loading the whole workbook.
+    """
+    workbook = load_workbook(_stream(source), read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = [str(cell).strip() if cell is not None else '' for cell in header]
+
+        missing = _missing_message(columns)
+        if missing:
+            raise SheetError(missing)
+        positions = [columns.index(col) for col in REQUIRED_COLUMNS]
+
+        start = 0
+        block = []
+        for row in rows:
+            block.append([row[pos] if pos < len(row) else None for pos in positions])
+            if len(block) >= chunk_size:
+                yield pd.DataFrame(block, columns=REQUIRED_COLUMNS, index=range(start, start + len(block)))
+                start += len(block)
+                block = []
+        if block:
+            yield pd.DataFrame(block, columns=REQUIRED_COLUMNS, index=range(start, start + len(block)))
+    finally:
+        workbook.close()
+
+
+def _iter_frames(source, filename, chunk_size):
+    sheet_format = _sheet_format(source, filename)
+
+    if sheet_format == '.csv':
+        frames = pd.read_csv(_stream(source), dtype=str, chunksize=chunk_size)
+    elif sheet_format == '.xlsx':
+        yield from _iter_xlsx_frames(source, chunk_size)
+        return
+    else:
+        # Legacy .xls has no streaming reader; read once and slice
+        df = pd.read_excel(_stream(source), dtype=str)
+        frames = (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+
+    first = True
+    for frame in frames:
+        if first:
+            missing = _missing_message(frame.columns)
+            if missing:
+                raise SheetError(missing)
+            first = False
+        yield frame
+
+
+def check_columns(source, filename=None):
     """
+    Reads only the header row.
+    Returns a tuple: (ok, message)
+    """
+    sheet_format = _sheet_format(source, filename)
+    stream = _stream(source)
     try:
-        # Read Excel file into a DataFrame
-        df = pd.read_excel(file_storage)
+        if sheet_format == '.csv':
+            columns = pd.read_csv(stream, dtype=str, nrows=0).columns
+        elif sheet_format == '.xlsx':
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+            try:
+                header = next(workbook.active.iter_rows(max_row=1, values_only=True), None) or ()
+            finally:
+                workbook.close()
+            columns = [str(cell).strip() for cell in header if cell is not None]
+        else:
+            columns = pd.read_excel(stream, dtype=str, nrows=0).columns
     except Exception as e:
-        return None, f"❌ Error reading Excel file: {str(e)}"
+        return False, f"❌ Error reading Excel file: {str(e)}"
+    finally:
+        if hasattr(stream, 'seek'):
+            stream.seek(0)
 
-    # Ensure required columns are present
-    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
-    if missing_columns:
-        return None, f"❌ Missing required columns: {', '.join(missing_columns)}"
+    missing = _missing_message(columns)
+    if missing:
+        return False, missing
+    return True, "✅ Sheet has the required columns."
 
-    contacts = []
 
-    # Iterate over rows and extract valid contacts
-    for idx, row in df.iterrows():
-        name = str(row.get('Name', '')).strip()
-        phone = str(row.get('Phone', '')).strip()
-        email = str(row.get('Email', '')).strip()
-
-        if not name or not phone or not email:
-            print(f"⚠️ Row {idx + 2} skipped — missing fields: Name='{name}', Phone='{phone}', Email='{email}'")
-            continue
-
-        contacts.append({
-            'name': name,
-            'phone': phone,
-            'email': email
-        })
+def iter_contacts(source, filename=None, chunk_size=None):
+    """
+    Stream contacts from an .xlsx, .xls or .csv sheet (path, file object or FileStorage).
+    Yields lists of contact dicts of at most chunk_size, de-duplicated across the whole sheet.
+    Raises SheetError if required columns are missing.
+    """
+    chunk_size = chunk_size or CONTACT_CHUNK_SIZE
+    seen = set()
+
+    for frame in _iter_frames(source, filename, chunk_size):
+        df, skipped = _clean_frame(frame)
+        if skipped:
+            shown = ', '.join(str(row) for row in skipped[:10])
+            more = f" and {len(skipped) - 10} more" if len(skipped) > 10 else ""
+            logging.warning(f"⚠️ Skipped {len(skipped)} row(s) with missing fields: rows {shown}{more}")
+
+        contacts = []
+        for key in zip(df['Name'], df['Phone'], df['Email']):
+            if key in seen:
+                continue
+            seen.add(key)
+            contacts.append({'name': key[0], 'phone': key[1], 'email': key[2]})
+
+        if contacts:
+            yield contacts
+
+
+def parse_excel(file_storage, filename=None):
+    """
+    Parses an uploaded sheet (Excel or CSV) from Flask's FileStorage object or a path.
+    Returns a tuple: (list of contact dicts, message)
+    """
+    contacts = []
+    try:
+        for chunk in iter_contacts(file_storage, filename=filename):
+            contacts.extend(chunk)
+    except SheetError as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"❌ Error reading Excel file: {str(e)}"
 
     if not contacts:
         return None, "❌ No valid contacts found in the Excel file."
@@ -0,0 +1,98 @@
+import os
+import re
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Country code assumed for numbers written without one (Excel drops the '+91')
+DEFAULT_COUNTRY_CODE = os.getenv('DEFAULT_COUNTRY_CODE', '91')
+
+EMAIL_PATTERN = r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}'
+# Basic India format validation: +91 followed by 10 digits
+PHONE_PATTERN = r'\+91\d{10}'
+
+EMAIL_RE = re.compile(EMAIL_PATTERN, re.IGNORECASE)
+PHONE_RE = re.compile(PHONE_PATTERN)
+
+PHONE_MODES = ['sms', 'whatsapp', 'call']
+
+
+def normalize_phones(phones):
+    """
+    Vectorized E.164 normalization of a Series of raw phone cells.
+    Handles Excel floats ('9876543210.0'), spaces/dashes/brackets, a leading 0,
+    a '00' international prefix and a country code without '+'.
+    Returns a Series of E.164 strings ('' where the number cannot be normalized).
+    """
+    digits = (
+        phones.fillna('').astype(str).str.strip()
+        .str.replace(r'\.0$', '', regex=True)
+        .str.replace(r'[\s\-().]', '', regex=True)
+    )
+    international = digits.str.startswith('+') | digits.str.startswith('00')
+    digits = digits.str.replace(r'^(\+|00)', '', regex=True)
+
+    national = digits.str.fullmatch(r'\d{10}')
+    trunk = digits.str.fullmatch(r'0\d{10}')
+    with_code = digits.str.fullmatch(DEFAULT_COUNTRY_CODE + r'\d{10}')
+
+    e164 = pd.Series('', index=phones.index, dtype=object)
+    e164 = e164.mask(international & digits.str.fullmatch(r'\d+'), '+' + digits)
+    e164 = e164.mask(~international & national, '+' + DEFAULT_COUNTRY_CODE + digits)
+    e164 = e164.mask(~international & trunk, '+' + DEFAULT_COUNTRY_CODE + digits.str[1:])
+    e164 = e164.mask(~international & with_code, '+' + digits)
+    return e164
+
+
+def normalize_emails(emails):
+    return emails.fillna('').astype(str).str.strip().str.lower()
+
+
+class ContactValidator:
+    """
+    Bulk validation for one campaign's channel, run on each parsed chunk before
+    any provider or LLM call. Duplicates are tracked across every chunk it sees.
+    """
+
+    def __init__(self, mode, field=None):
+        self.mode = mode
+        self.field = field or ('phone' if mode in PHONE_MODES else 'email')
+        self._seen = set()
+
+    def validate(self, contacts):
+        """
+        Partition contacts for this channel.
+        Returns a tuple: (valid contacts with normalized phone/email, list of (contact, reason))
+        """
+        if not contacts:
+            return [], []
+
+        df = pd.DataFrame(contacts, columns=['name', 'phone', 'email'])
+        if self.field == 'phone':
+            normalized = normalize_phones(df['phone'])
+            valid = normalized.str.fullmatch(PHONE_PATTERN)
+            label = "phone number"
+        else:
+            normalized = normalize_emails(df['email'])
+            valid = normalized.str.fullmatch(EMAIL_PATTERN, case=False)
+            label = "email address"
+
+        # First occurrence wins, within this chunk and against earlier chunks
+        duplicate = normalized.duplicated() | normalized.isin(self._seen)
+
+        passed = []
+        rejected = []
+        for contact, value, is_valid, is_duplicate in zip(contacts, normalized, valid, duplicate):
+            raw = contact.get(self.field) or ''
+            if not raw:
+                rejected.append((contact, f"❌ Contact info missing for mode '{self.mode}'."))
+            elif not is_valid:
+                rejected.append((contact, f"❌ Invalid {label}: {raw}"))
+            elif is_duplicate:
+                rejected.append((contact, f"❌ Duplicate {label}: {value}"))
+            else:
+                passed.append(dict(contact, **{self.field: value}))
+
+        self._seen.update(contact[self.field] for contact in passed)
+        return passed, rejected
@@ -0,0 +1,253 @@
+"""
+Campaign worker: claims queued jobs from the SQLite job queue and dispatches them.
+
+Run one or more alongside the web app, e.g.:
+    python worker.py --processes 4
+"""
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+from dotenv import load_dotenv
+
+import jobs
+import metrics
+from dispatcher import dispatch_stream, dispatch_multi
+from uploads import iter_sheet_contacts, purge_spool
+from contact_store import ContactStore
+from scheduler import Scheduler, Deferred
+
+load_dotenv()
+
+WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '1'))
+# Minimum seconds between progress writes to the job row
+PROGRESS_INTERVAL = float(os.getenv('WORKER_PROGRESS_INTERVAL', '1'))
+# Seconds between sweeps for expired job files and spooled uploads
+PURGE_INTERVAL = float(os.getenv('WORKER_PURGE_INTERVAL', '3600'))
+
+
+class ProgressReporter:
+    """
+    Counts results from dispatch threads and writes them to the job row,
+    at most once per PROGRESS_INTERVAL so SQLite is not written per contact.
+    """
+
+    def __init__(self, conn, job_id, total=0):
+        self.conn = conn
+        self.job_id = job_id
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def _flush(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_flush >= PROGRESS_INTERVAL:
+            self._last_flush = now
+            jobs.update_progress(self.conn, self.job_id, self.sent, self.failed, self.total)
+
+    def add_contacts(self, contacts):
+        # A streamed sheet reveals its size chunk by chunk
+        with self._lock:
+            self.total += len(contacts)
+            self._flush(force=True)
+
+    def heartbeat(self, stop_event, interval=None):
+        # Keeps updated_at fresh through long quiet spells (LLM generation, a throttled
+        # channel) so other workers do not mistake this job for an abandoned one
+        interval = interval or jobs.JOB_STALE_AFTER / 3
+        while not stop_event.wait(interval):
+            with self._lock:
+                self._flush(force=True)
+
+    def __call__(self, contact, success, msg):
+        with self._lock:
+            if success:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._flush()
+
+
+def _count_contacts(payload):
+    """
+    How many contacts a campaign has, for pacing it over a window. A sheet is parsed
+    here (filling the parse cache the campaign then reads); with save_list_as in delta
+    mode this is the whole sheet, so the campaign may finish early.
+    """
+    if payload.get('contact_list'):
+        with ContactStore() as store:
+            return store.count(payload['contact_list'], filters=payload.get('contact_filter'))
+    if payload.get('sheet'):
+        filename, path = payload['sheet']
+        contacts = iter_sheet_contacts(path, filename=filename, digest=payload.get('sheet_digest'))
+        return sum(len(chunk) for chunk in contacts)
+    return len(payload['contacts'])
+
+
+def run_job(conn, job):
+    payload = json.loads(job['payload'])
+    logging.info(f"Running job {job['id']} ({job['mode']}, {job['total']} contact(s))")
+
+    # The reporter gets its own connection: it is called from dispatch threads
+    progress_conn = jobs.connect()
+    reporter = ProgressReporter(progress_conn, job['id'])
+    dead_letters = []
+    unchanged = []
+    store = None
+    scheduler = Scheduler()
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=reporter.heartbeat, args=(stop_heartbeat,), daemon=True).start()
+    try:
+        if payload.get('contact_list'):
+            # A saved list: read from the contact store, no sheet to parse
+            store = ContactStore()
+            chunks = store.iter_contacts(payload['contact_list'], filters=payload.get('contact_filter'))
+        elif payload.get('sheet'):
+            # Stream the sheet: sending starts after the first chunk is parsed
+            filename, path = payload['sheet']
+            chunks = metrics.timed(
+                iter_sheet_contacts(path, filename=filename, digest=payload.get('sheet_digest')), 'parse'
+            )
+            if payload.get('save_list_as'):
+                store = ContactStore()
+                name = payload['save_list_as']
+                current = store.get_list(name)
+                on_unchanged = lambda contacts: unchanged.append(len(contacts))
+                if store.saved_by(job['id']) or (current['id'] if current else None) != payload.get('list_base'):
+                    # Saved by an earlier run of this job, or replaced by a newer upload since it
+                    # was queued: send without saving again
+                    chunks = store.changed(chunks, payload.get('delta_baseline'), on_unchanged=on_unchanged)
+                else:
+                    chunks = store.ingest(
+                        name, chunks, sheet_digest=payload.get('sheet_digest'),
+                        baseline=payload.get('delta_baseline'), on_unchanged=on_unchanged, job_id=job['id']
+                    )
+        else:
+            chunks = [payload['contacts']]
+
+        # Released on schedule: spread over the campaign's window, within daily caps
+        modes = payload.get('modes') or [job['mode']]
+        chunks = scheduler.paced(
+            job['id'], chunks, modes, spread_seconds=payload.get('spread_seconds'),
+            count=lambda: _count_contacts(payload)
+        )
+
+        def dead_letter(contact, msg, channel=None):
+            # Single-channel campaigns report without the channel
+            dead_letters.append((contact, msg, channel or modes[0]))
+
+        def unsent(mode, count):
+            # Released contacts were charged to the daily caps of the campaign's own channels
+            if mode in modes:
+                scheduler.refund(mode, count)
+
+        options = dict(
+            email_subject=payload.get('email_subject'),
+            attachments=jobs.load_attachments(payload),
+            on_result=reporter,
+            on_chunk=reporter.add_contacts,
+            campaign_id=job['id'],
+            on_dead_letter=dead_letter,
+            on_unsent=unsent
+        )
+        with metrics.CAMPAIGNS_RUNNING.track():
+            if len(modes) > 1 or payload.get('fallbacks'):
+                # Several channels, or fallbacks: one pass over the contacts, a lane per channel
+                successes, failures = dispatch_multi(
+                    chunks, modes, payload['use_custom'], payload['user_message'],
+                    fallbacks=payload.get('fallbacks'), **options
+                )
+            else:
+                successes, failures = dispatch_stream(
+                    chunks, modes[0], payload['use_custom'], payload['user_message'], **options
+                )
+        if not successes and not failures and not unchanged:
+            jobs.fail_job(conn, job['id'], "❌ No valid contacts found in the Excel file.")
+        else:
+            jobs.finish_job(conn, job['id'], successes, failures, dead_letters, unchanged=sum(unchanged))
+    except Deferred as e:
+        # Delivered contacts are in the ledger; the next run picks up the schedule
+        logging.info(f"Job {job['id']} deferred: {e}")
+        jobs.defer_job(conn, job['id'], e.run_at)
+    except Exception as e:
+        logging.error(f"Job {job['id']} failed", exc_info=True)
+        jobs.fail_job(conn, job['id'], str(e))
+    finally:
+        stop_heartbeat.set()
+        progress_conn.close()
+        scheduler.close()
+        if store is not None:
+            store.close()
+
+
+def purge_expired(conn):
+    """
+    Delete the files of jobs past their retention, what the contact store kept to resume
+    them, and spooled uploads no remaining job reads.
+    """
+    purged = jobs.purge_jobs(conn)
+    if purged:
+        with ContactStore() as store:
+            for job_id, payload in purged:
+                store.forget_job(job_id, payload.get('delta_baseline'))
+    purge_spool(keep=jobs.sheets_in_use(conn))
+
+
+def run_worker(stop_event=None):
+    """
+    Poll the queue until stop_event is set (forever if it is None).
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    conn = jobs.connect()
+    logging.info(f"Worker {worker_id} started")
+
+    next_purge = 0.0
+    try:
+        while stop_event is None or not stop_event.is_set():
+            # Swept between jobs; concurrent sweeps by other workers are harmless
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + PURGE_INTERVAL
+                try:
+                    purge_expired(conn)
+                except Exception:
+                    logging.error("Purging expired files failed", exc_info=True)
+
+            job = jobs.claim_next_job(conn, worker_id)
+            if job is None:
+                time.sleep(WORKER_POLL_INTERVAL)
+                continue
+            run_job(conn, job)
+    finally:
+        conn.close()
+
+
+def start_inline_worker():
+    """
+    Run a worker thread inside the web process (development convenience).
+    """
+    thread = threading.Thread(target=run_worker, name='inline-worker', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Process queued campaigns.")
+    parser.add_argument('--processes', type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker()
+    else:
+        processes = [multiprocessing.Process(target=run_worker) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()